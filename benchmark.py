@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+# Headless benchmark of UnicodEmoticon startup, background catalog loading,
+# menu build, menu popup and Python objects per glyph action,
+# also checks that rarely used modules are not imported at startup.
+# python3 benchmark.py                 # run and compare against the baseline
+# python3 benchmark.py --save          # run and store results as the baseline
+# python3 benchmark.py --runs=9 --tolerance=2.0
+
+
+"""Benchmark for UnicodEmoticon, headless using Qt offscreen platform."""
+
+
+import json
+import os
+import sys
+import time
+from getopt import getopt
+from os import path
+
+
+HERE = path.dirname(path.abspath(__file__))
+BASELINE_FILE = path.join(HERE, "benchmark_baseline.json")
+# metrics where bigger is worse, with how much bigger than baseline is allowed
+TOLERANCES = {"import_s": 1.5, "tray_icon_s": 1.5, "menus_ready_s": 1.5,
+              "submenus_s": 1.5, "popup_s": 1.5, "peak_rss_kb": 1.2,
+              "qactions": 1.1, "objects_per_glyph": 1.1,
+              "startup_modules": 1.1}
+# synthetic submenu sizes, to see how Python objects scale with the catalog
+GLYPH_COUNTS = (1000, 4000, 16000)
+# modules that must not be imported until the menus are ready, html.entities
+# and unicodedata are not here, the prepare_catalogs thread needs them
+DEFERRED_MODULES = ("datetime", "subprocess", "urllib.request", "webbrowser",
+                    "PyQt5.QtNetwork")
+STARTUP_DONE = "benchmark: menus ready"  # printed after the catalogs thread
+
+
+def child():
+    """Measure one fresh process and print the results as JSON."""
+    started = time.perf_counter()
+    sys.path.insert(0, HERE)
+    import unicodemoticon
+    results = {"import_s": time.perf_counter() - started}
+    from PyQt5.QtGui import QIcon
+    from PyQt5.QtCore import QEventLoop
+    from PyQt5.QtWidgets import QAction, QApplication, QStyle
+    app = QApplication(sys.argv)
+    started = time.perf_counter()
+    win = unicodemoticon.MainWindow(
+        QIcon(app.style().standardPixmap(QStyle.SP_FileIcon)))
+    results["tray_icon_s"] = time.perf_counter() - started
+    loop = QEventLoop()
+    win.menus_ready.connect(loop.quit)
+    loop.exec_()  # catalogs prepared in background, menus added in slices
+    results["menus_ready_s"] = time.perf_counter() - started
+    print(STARTUP_DONE, file=sys.stderr, flush=True)
+    submenus = {}
+    for action in win.traymenu.actions():
+        if action.menu():
+            started = time.perf_counter()
+            action.menu().aboutToShow.emit()  # builds lazy submenus
+            submenus[action.text()] = time.perf_counter() - started
+    results["submenus_s"] = sum(submenus.values())
+    results["submenu_s"] = submenus
+    started = time.perf_counter()
+    win.traymenu.popup(win.traymenu.pos())
+    app.processEvents()
+    results["popup_s"] = time.perf_counter() - started
+    win.traymenu.hide()
+    results["qactions"] = len(win.traymenu.findChildren(QAction))
+    import resource
+    results["peak_rss_kb"] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss // (
+            1024 if sys.platform.startswith("darwin") else 1)  # bytes on Mac
+    results["objects_scaling"] = objects_scaling(win)  # after peak RSS
+    results["objects_per_glyph"] = results["objects_scaling"][
+        str(GLYPH_COUNTS[-1])]
+    print(json.dumps(results))
+
+
+def objects_scaling(win):
+    """Return the Python objects added per glyph, by submenu size."""
+    import gc
+    from PyQt5.QtWidgets import QMenu
+    scaling = {}
+    for count in GLYPH_COUNTS:
+        menu, glyphs = QMenu(), [chr(0x4E00 + index) for index in range(count)]
+        gc.collect()
+        before = len(gc.get_objects())
+        win.build_submenu(glyphs, menu)
+        gc.collect()
+        scaling[str(count)] = (len(gc.get_objects()) - before) / count
+        menu.deleteLater()
+    return scaling
+
+
+def startup_imports(stderr):
+    """Parse -X importtime output, return the modules imported at startup."""
+    modules = []
+    for line in stderr.splitlines():
+        if line.startswith(STARTUP_DONE):
+            break
+        if line.startswith("import time:") and "[us]" not in line:
+            modules.append(line.split("|")[-1].strip())
+    return modules
+
+
+def run_child(env):
+    """Run one child process under -X importtime and return its results."""
+    import subprocess  # not at module level, the child must not import it
+    child_process = subprocess.run(
+        (sys.executable, "-X", "importtime", __file__, "--child"), env=env,
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    results = json.loads(child_process.stdout.decode("utf-8"))
+    modules = startup_imports(child_process.stderr.decode("utf-8"))
+    results["startup_modules"] = len(modules)
+    results["deferred_imported"] = sorted(set(DEFERRED_MODULES) &
+                                          set(modules))
+    return results
+
+
+def run(runs):
+    """Run the benchmark in fresh processes and return the median results."""
+    from statistics import median
+    from tempfile import mkdtemp
+    home = mkdtemp()  # dont touch the real config nor running instance
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", HOME=home,
+               XDG_RUNTIME_DIR=home)
+    samples = [run_child(env) for _ in range(runs)]
+    results = {metric: median(sample[metric] for sample in samples)
+               for metric in TOLERANCES}
+    results["deferred_imported"] = samples[0]["deferred_imported"]
+    results["submenu_s"] = {label: median(sample["submenu_s"][label]
+                                          for sample in samples)
+                            for label in samples[0]["submenu_s"]}
+    results["objects_scaling"] = samples[0]["objects_scaling"]
+    return results
+
+
+def compare(results, baseline, tolerance=None):
+    """Print the results against the baseline, return the regressions."""
+    regressions = []
+    for metric, allowed in sorted(TOLERANCES.items()):
+        allowed = tolerance or allowed
+        value, base = results[metric], baseline.get(metric)
+        ratio = value / base if base else 1.0
+        status = "REGRESSION" if ratio > allowed else "ok"
+        if ratio > allowed:
+            regressions.append(metric)
+        print("{:<12} {:>14.6g} {:>14.6g} {:>7.2f}x {}".format(
+            metric, value, base or 0, ratio, status))
+    if results["deferred_imported"]:
+        regressions.append("deferred_imported")
+        print("REGRESSION imported at startup: " +
+              ", ".join(results["deferred_imported"]))
+    for label, value in sorted(results["submenu_s"].items(),
+                               key=lambda item: -item[1])[:5]:
+        print("  slowest submenu {:<20} {:.6f}s".format(label, value))
+    for count, value in sorted(results["objects_scaling"].items(),
+                               key=lambda item: int(item[0])):
+        print("  Python objects per glyph in a {:>6} glyph submenu {:.3f}"
+              .format(count, value))
+    return regressions
+
+
+def main():
+    """Main Loop."""
+    opts = dict(getopt(sys.argv[1:], "", ["child", "save", "runs=",
+                                          "tolerance="])[0])
+    if "--child" in opts:
+        return child()
+    results = run(int(opts.get("--runs", 5)))
+    if "--save" in opts:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True,
+                      ensure_ascii=False)
+        print("Saved baseline to " + BASELINE_FILE)
+    try:
+        with open(BASELINE_FILE, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    except OSError:
+        baseline = {}
+    tolerance = opts.get("--tolerance")
+    if compare(results, baseline, float(tolerance) if tolerance else None):
+        sys.exit(1)
+
+
+if __name__ in '__main__':
+    main()
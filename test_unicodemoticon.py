@@ -0,0 +1,1064 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#
+# Tests of UnicodEmoticon, network code against a local HTTP server stand-in,
+# headless.
+# python3 -m pytest test_unicodemoticon.py  # or: python3 -m unittest
+
+
+"""Tests for UnicodEmoticon, using Qt offscreen platform."""
+
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")  # before importing Qt
+
+from PyQt5.QtCore import QEventLoop, QTimer  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+import unicodemoticon  # noqa: E402
+
+
+APP = QApplication.instance() or QApplication([])
+SOURCE = ("__version__ = '9.9.9'\n" + "# padding line\n" * 20000).encode(
+    "utf-8")
+ETAG = '"{}"'.format(sha256(SOURCE).hexdigest()[:16])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    """Serves server.files with ETag, Range, If-Range and If-None-Match."""
+
+    def do_GET(self):
+        """Answer like a static file server would."""
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path not in self.server.files:
+            return self.send_error(404)
+        data = self.server.files[self.path]
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            return self.end_headers()
+        byte_range = self.headers.get("Range")
+        if byte_range and self.server.ranges and self.headers.get(
+                "If-Range", ETAG) == ETAG:
+            start, end = byte_range.split("=")[1].split("-")
+            end = int(end) if end else len(data) - 1
+            body = data[int(start):end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                start, int(start) + len(body) - 1, len(data)))
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        if self.server.lengths:  # else HTTP/1.0 ends the body on close
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not self.server.lengths:  # in two parts, to report progress
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            time.sleep(0.5)
+            body = body[len(body) // 2:]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Dont log every request."""
+
+
+class QuietDownloader(unicodemoticon.Downloader):
+
+    """Downloader that records the messages instead of showing them."""
+
+    messages, progress = [], []
+
+    def report(self, message, error=False):
+        """Record the message."""
+        self.messages.append((message, error))
+
+    def update_download_progress(self, bytesReceived, bytesTotal):
+        """Record the progress and the progress bar maximum."""
+        super(QuietDownloader, self).update_download_progress(bytesReceived,
+                                                              bytesTotal)
+        self.progress.append((bytesReceived, bytesTotal, self.maximum()))
+
+
+class StandInTestCase(unittest.TestCase):
+
+    """Runs a local HTTP server and gives a temporary folder."""
+
+    def setUp(self):
+        """Start the server on a free port."""
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.files = {"/source.py": SOURCE}
+        self.server.requests, self.server.ranges = [], True
+        self.server.lengths = True
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = "http://127.0.0.1:{}/source.py".format(
+            self.server.server_port)
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def tearDown(self):
+        """Stop the server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DownloaderTest(StandInTestCase):
+
+    """Streaming, checksum and resume of the self-update download."""
+
+    def setUp(self):
+        """Give an old file to update."""
+        super(DownloaderTest, self).setUp()
+        self.dst = os.path.join(self.folder, "unicodemoticon.py")
+        with open(self.dst, "wb") as dst_file:
+            dst_file.write(b"__version__ = '1.0.0'\n")
+        QuietDownloader.messages, QuietDownloader.progress = [], []
+
+    def download(self, **kwargs):
+        """Run the modal downloader, closed if it hangs."""
+        timeout = QTimer()
+        timeout.setSingleShot(True)
+        timeout.timeout.connect(lambda: APP.activeModalWidget() and
+                                APP.activeModalWidget().close())
+        timeout.start(10000)
+        QuietDownloader(url=self.url, dst=self.dst, **kwargs)
+        timeout.stop()
+        with open(self.dst, "rb") as dst_file:
+            return dst_file.read()
+
+    def test_published_checksum(self):
+        """The SHA256 published next to the source is checked."""
+        self.server.files["/source.py.sha256"] = "{}  source.py\n".format(
+            sha256(SOURCE).hexdigest()).encode("ascii")
+        self.assertEqual(self.download(), SOURCE)
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+        self.assertEqual(self.server.requests[0][0], "/source.py.sha256")
+
+    def test_checksum_mismatch(self):
+        """A download not matching the SHA256 does not replace the file."""
+        self.server.files["/source.py.sha256"] = b"0" * 64
+        self.assertEqual(self.download(), b"__version__ = '1.0.0'\n")
+        self.assertIn("SHA256 mismatch", QuietDownloader.messages[-1][0])
+        self.assertFalse(os.path.exists(self.dst + ".part"))
+
+    def test_resume(self):
+        """A partial file with a matching validator resumes with Range."""
+        with open(self.dst + ".part", "wb") as part_file:
+            part_file.write(SOURCE[:100000])
+        with open(self.dst + ".part.validator", "wb") as validator:
+            validator.write(ETAG.encode("ascii"))
+        self.assertEqual(self.download(checksum=sha256(SOURCE).hexdigest()),
+                         SOURCE)
+        headers = self.server.requests[-1][1]
+        self.assertEqual(headers["Range"], "bytes=100000-")
+        self.assertEqual(headers["If-Range"], ETAG)
+        self.assertFalse(os.path.exists(self.dst + ".part.validator"))
+
+    def test_resume_unknown_size(self):
+        """A resumed download without Content-Length has no total."""
+        self.server.lengths = False
+        with open(self.dst + ".part", "wb") as part_file:
+            part_file.write(SOURCE[:100000])
+        with open(self.dst + ".part.validator", "wb") as validator:
+            validator.write(ETAG.encode("ascii"))
+        self.assertEqual(self.download(checksum=sha256(SOURCE).hexdigest()),
+                         SOURCE)
+        unknown = [progress for progress in QuietDownloader.progress
+                   if progress[1] < 0]  # Qt ends with the received total
+        self.assertTrue(unknown)
+        for received, total, maximum in unknown:
+            self.assertEqual(maximum, 0)  # busy, not past 100%
+            self.assertGreater(received, 100000)
+
+    def test_resume_changed_source(self):
+        """A partial file of another version starts over."""
+        with open(self.dst + ".part", "wb") as part_file:
+            part_file.write(b"x" * 1000)
+        with open(self.dst + ".part.validator", "wb") as validator:
+            validator.write(b'"old"')
+        self.assertEqual(self.download(checksum=sha256(SOURCE).hexdigest()),
+                         SOURCE)
+
+    def test_resume_not_supported(self):
+        """A server ignoring Range sends it all, the part is replaced."""
+        self.server.ranges = False
+        with open(self.dst + ".part", "wb") as part_file:
+            part_file.write(SOURCE[:100000])
+        with open(self.dst + ".part.validator", "wb") as validator:
+            validator.write(ETAG.encode("ascii"))
+        self.assertEqual(self.download(checksum=sha256(SOURCE).hexdigest()),
+                         SOURCE)
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    """Atomic writes of the caches and config files."""
+
+    def setUp(self):
+        """Give a temporary folder."""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_write(self):
+        """Text and bytes are written, the folder is made."""
+        filename = os.path.join(self.folder, "new", "file.json")
+        unicodemoticon.atomic_write(filename, "caf\u00e9")
+        with open(filename, encoding="utf-8") as written:
+            self.assertEqual(written.read(), "caf\u00e9")
+        unicodemoticon.atomic_write(filename, b"\x00\xff")
+        with open(filename, "rb") as written:
+            self.assertEqual(written.read(), b"\x00\xff")
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ["file.json"])
+
+    def test_failed(self):
+        """A failed write leaves no temporary file behind."""
+        os.mkdir(os.path.join(self.folder, "folder"))
+        with self.assertRaises(OSError):
+            unicodemoticon.atomic_write(
+                os.path.join(self.folder, "folder"), "text")
+        self.assertEqual(os.listdir(self.folder), ["folder"])
+
+
+class UpdateProbeTest(StandInTestCase):
+
+    """Background version probe, with validators and back off."""
+
+    def setUp(self):
+        """Give a fresh update state file."""
+        super(UpdateProbeTest, self).setUp()
+        self.state_file = os.path.join(self.folder, "update.json")
+
+    def probe(self, url=None):
+        """Run a probe to the end, return its version and state."""
+        loop, versions = QEventLoop(), []
+        probe = unicodemoticon.UpdateProbe(url or self.url, self.state_file)
+        probe.finished.connect(versions.append)
+        probe.finished.connect(loop.quit)
+        QTimer.singleShot(10000, loop.quit)
+        probe.start()
+        loop.exec_()
+        return versions[0], probe.state
+
+    def test_version_from_head(self):
+        """Only the head of the source is requested and read."""
+        version, state = self.probe()
+        self.assertEqual(version, "9.9.9")
+        self.assertEqual(state.etag, ETAG)
+        self.assertEqual(self.server.requests[0][1]["Range"], "bytes=0-1023")
+        self.assertGreater(state.next_check, time.time())
+
+    def test_not_modified(self):
+        """A 304 to the saved ETag keeps the saved version."""
+        self.probe()
+        version, state = self.probe()
+        self.assertEqual(version, "9.9.9")
+        self.assertEqual(self.server.requests[-1][1]["If-None-Match"], ETAG)
+        self.assertEqual(state.failures, 0)
+
+    def test_range_ignored(self):
+        """A server sending the whole source is cut at the head."""
+        self.server.ranges = False
+        self.assertEqual(self.probe()[0], "9.9.9")
+
+    def test_not_source(self):
+        """A page without the __version__ line is a failed probe."""
+        self.server.files["/source.py"] = (
+            b"<html><title>Login</title>2026 Hotel WiFi, error 404</html>")
+        version, state = self.probe()
+        self.assertEqual((version, state.failures), ("", 1))
+        self.assertIsNone(state.version)
+        self.assertGreater(state.next_check, time.time())
+
+    def test_back_off(self):
+        """Failures back off exponentially, and are saved."""
+        self.server.server_close()
+        url = "http://127.0.0.1:{}/source.py".format(self.server.server_port)
+        version, state = self.probe(url)
+        self.assertEqual((version, state.failures), ("", 1))
+        first_delay = state.next_check - time.time()
+        state.next_check = 0.0
+        state.save()
+        version, state = self.probe(url)
+        self.assertEqual((version, state.failures), ("", 2))
+        self.assertLessEqual(first_delay, unicodemoticon.UPDATE_RETRY)
+        self.assertLessEqual(state.next_check - time.time(),
+                             unicodemoticon.UPDATE_RETRY * 2)
+
+    def test_save_error(self):
+        """A state that can not be saved is kept in memory."""
+        state_file = os.path.join(self.folder, "file", "update.json")
+        open(os.path.join(self.folder, "file"), "w").close()
+        state = unicodemoticon.UpdateState(self.url, state_file)
+        state.failed(time.time())
+        self.assertEqual(state.failures, 1)
+
+
+class InstanceServerTest(unittest.TestCase):
+
+    """Local socket server of the running instance."""
+
+    def setUp(self):
+        """Put the socket file in a temporary folder."""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = mock.patch.object(unicodemoticon, "SOCKET_FILE",
+                                    os.path.join(self.folder, "run",
+                                                 "instance.sock"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def server(self):
+        """Return a server answering queries with the request."""
+        server = unicodemoticon.InstanceServer(lambda: None, lambda r: [r])
+        self.addCleanup(server.close)
+        return server
+
+    def serve(self, target):
+        """Run target on a thread while the server answers, return it."""
+        results = []
+        thread = threading.Thread(target=lambda: results.append(target()))
+        thread.start()
+        while thread.is_alive():
+            APP.processEvents()
+        return results[0]
+
+    def test_private_folder(self):
+        """The socket folder is made private to the user."""
+        self.assertTrue(hasattr(self.server(), "notifier"))
+        self.assertEqual(os.stat(os.path.join(
+            self.folder, "run")).st_mode & 0o777, 0o700)
+
+    def test_shared_folder(self):
+        """A socket folder others can write is not trusted."""
+        os.mkdir(os.path.join(self.folder, "run"))
+        os.chmod(os.path.join(self.folder, "run"), 0o777)
+        self.assertFalse(hasattr(self.server(), "notifier"))
+        with self.assertRaises(PermissionError):
+            unicodemoticon.instance_request([{"command": "show"}])
+
+    def test_request(self):
+        """Batched requests are answered in order over the socket."""
+        self.server()
+        requests = [{"command": "query", "query": str(index)}
+                    for index in range(3)]
+        self.assertEqual(self.serve(lambda: unicodemoticon.instance_request(
+            requests)), [{"results": [request]} for request in requests])
+
+    def test_slow_reader(self):
+        """A client not reading its answer does not block the server."""
+        server = unicodemoticon.InstanceServer(
+            lambda: None, lambda r: ["x" * 1000] * 5000)
+        self.addCleanup(server.close)
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(unicodemoticon.SOCKET_FILE)
+            client.sendall(b'{"command": "query"}\n')
+            slowest, deadline = 0.0, time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                APP.processEvents()
+                slowest = max(slowest, time.monotonic() - started)
+            self.assertLess(slowest, 0.25)
+            answer = self.serve(lambda: client.makefile("rb").readline())
+        self.assertEqual(len(json.loads(answer.decode())["results"]), 5000)
+
+    def test_stale_socket(self):
+        """A socket file nobody listens on is replaced."""
+        os.mkdir(os.path.join(self.folder, "run"), 0o700)
+        with socket.socket(socket.AF_UNIX) as stale:
+            stale.bind(unicodemoticon.SOCKET_FILE)
+        self.assertTrue(hasattr(self.server(), "notifier"))
+
+    def test_live_socket(self):
+        """The socket of a running instance is left alone."""
+        self.server()
+        second = unicodemoticon.InstanceServer(lambda: None, lambda r: [])
+        self.assertFalse(hasattr(second, "notifier"))
+        self.assertTrue(os.path.exists(unicodemoticon.SOCKET_FILE))
+
+    def test_answer(self):
+        """Queries are answered by the query of the instance."""
+        server = self.server()
+        request = {"command": "query", "query": "smile"}
+        self.assertEqual(server.answer(json.dumps(request).encode("utf-8")),
+                         {"results": [request]})
+        server.query = lambda request: None
+        self.assertIn("error", server.answer(json.dumps(request).encode()))
+
+
+class QueryTest(unittest.TestCase):
+
+    """Command line query mode, without a running instance."""
+
+    def setUp(self):
+        """Read no catalogs of the user, forget those of other tests."""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        user_catalog_dir = os.path.join(self.folder, "catalogs")
+        for name, value in (
+                ("USER_CATALOG_DIR", user_catalog_dir),
+                ("CACHE_DIR", os.path.join(self.folder, "cache")),
+                ("EMOJI_TEST_FILES",
+                 (os.path.join(user_catalog_dir, "emoji-test.txt"),)),
+                ("CLDR_FILES", (os.path.join(user_catalog_dir, "en.xml"),))):
+            patcher = mock.patch.object(unicodemoticon, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for cached in (unicodemoticon.query_prepared,
+                       unicodemoticon.query_search_index,
+                       unicodemoticon.load_emoji_catalog,
+                       unicodemoticon.emoji_annotations):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+    def test_list_not_indexed(self):
+        """Listing and filtering by category dont build the search index."""
+        counts = {entry["category"]: entry["count"] for entry in
+                  unicodemoticon.query_results({"list": True})}
+        self.assertEqual(counts["cats"], len(
+            unicodemoticon.UNICODEMOTICONS["cats"]))
+        entries = list(unicodemoticon.query_results({"category": "Cats"}))
+        self.assertTrue(entries)
+        self.assertTrue(all("cats" in entry["category"].split(",")
+                            for entry in entries))
+        self.assertEqual(
+            unicodemoticon.query_search_index.cache_info().currsize, 0)
+
+    def test_query_indexed(self):
+        """Query words are searched in an index built on the first query."""
+        entries = list(unicodemoticon.query_results({"query": "cat tears"}))
+        self.assertEqual(entries[0]["glyph"], "\U0001F639")
+        self.assertEqual(
+            unicodemoticon.query_search_index.cache_info().currsize, 1)
+
+
+class UserCatalogTest(unittest.TestCase):
+
+    """User catalogs in JSON or TOML files."""
+
+    def setUp(self):
+        """Give a temporary folder."""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write(self, name, text):
+        """Write a user catalog file and return its path."""
+        filename = os.path.join(self.folder, name)
+        with open(filename, "w", encoding="utf-8") as catalog_file:
+            catalog_file.write(text)
+        return filename
+
+    def test_parse(self):
+        """A string is split in chars, a list is kept, both sorted."""
+        self.assertEqual(unicodemoticon.parse_user_catalog(self.write(
+            "user.json", '{"Cards": "\u2663\u2660", "Faces": [":)", ":("]}')),
+            {"cards": ("\u2660", "\u2663"), "faces": (":(", ":)")})
+
+    def test_graphemes(self):
+        """A string is split in graphemes, emoji sequences stay whole."""
+        text = ("\U0001F44B\U0001F3FB \U0001F469\u200D\U0001F4BB "
+                "\U0001F1E9\U0001F1EA\U0001F1EB\U0001F1F7 \u2764\uFE0F "
+                "1\uFE0F\u20E3 e\u0301")
+        self.assertEqual(unicodemoticon.parse_user_catalog(self.write(
+            "user.json", json.dumps({"mixed": text})))["mixed"], tuple(sorted((
+                "\U0001F44B\U0001F3FB", "\U0001F469\u200D\U0001F4BB",
+                "\U0001F1E9\U0001F1EA", "\U0001F1EB\U0001F1F7",
+                "\u2764\uFE0F", "1\uFE0F\u20E3", "e\u0301"))))
+
+    def test_not_entries(self):
+        """A table or object is not taken for its keys."""
+        for name, text in (("user.json", '{"cards": {"a": 1}}'),
+                           ("user.toml", "[cards]\na = 1\n"),
+                           ("user.json", '{"cards": 1}')):
+            with self.assertRaises(ValueError):
+                unicodemoticon.parse_user_catalog(self.write(name, text))
+
+    def test_empty(self):
+        """An empty user catalog compiles empty, not the built-in one."""
+        filename = os.path.join(self.folder, "user.catalog")
+        unicodemoticon.compile_catalog(filename, {}, "", b"u" * 20)
+        self.assertEqual(len(unicodemoticon.MappedCatalog(
+            filename, b"u" * 20)), 0)
+
+
+class StartupProfilerTest(unittest.TestCase):
+
+    """Startup profiling of --profile."""
+
+    def test_tracing_kept(self):
+        """Tracing started before the profiler is not stopped by it."""
+        import tracemalloc
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        profiler = unicodemoticon.StartupProfiler()
+        profiler.phase("test")
+        profiler.stop()
+        self.assertTrue(tracemalloc.is_tracing())
+
+    def test_tracing_stopped(self):
+        """Tracing started by the profiler is stopped by it."""
+        import tracemalloc
+        unicodemoticon.StartupProfiler().stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class FontsFingerprintTest(unittest.TestCase):
+
+    """Fingerprint of the fonts, key of the coverage and atlas caches."""
+
+    def setUp(self):
+        """Forget the fingerprints of other tests."""
+        unicodemoticon.fonts_fingerprint.cache_clear()
+        self.addCleanup(unicodemoticon.fonts_fingerprint.cache_clear)
+
+    def test_font_file_changed(self):
+        """A font file updated under the same family changes it."""
+        with mock.patch.object(unicodemoticon, "font_files",
+                               lambda: iter(["/fonts/a.ttf\t1\t100"])):
+            before = unicodemoticon.fonts_fingerprint("Oxygen,25")
+        unicodemoticon.fonts_fingerprint.cache_clear()
+        with mock.patch.object(unicodemoticon, "font_files",
+                               lambda: iter(["/fonts/a.ttf\t2\t100"])):
+            self.assertNotEqual(
+                unicodemoticon.fonts_fingerprint("Oxygen,25"), before)
+
+    def test_coverage_fingerprint(self):
+        """The coverage fingerprint is kept by the instance."""
+        coverage = unicodemoticon.FontCoverage(
+            unicodemoticon.QFont("Oxygen", 25), {}, "digest")
+        self.assertEqual(coverage.fingerprint(), coverage.fingerprint())
+        self.assertIn("_fingerprint", vars(coverage))
+
+
+class ParseOptionsTest(unittest.TestCase):
+
+    """Command line options."""
+
+    def test_options(self):
+        """Known options are parsed, unknown ones are left to Qt."""
+        self.assertEqual(unicodemoticon.parse_options(
+            ["app", "--query=cat", "--format=json"]),
+            {"--query": "cat", "--format": "json"})
+        self.assertEqual(unicodemoticon.parse_options(
+            ["app", "-style", "fusion"]), {})
+
+    def test_qt_options_kept(self):
+        """Known options are kept next to unknown Qt options."""
+        self.assertEqual(unicodemoticon.parse_options(
+            ["app", "--profile", "-style", "fusion", "--atlas-memory=64",
+             "--log-level", "debug", "--platform=offscreen"]),
+            {"--profile": "", "--atlas-memory": "64", "--log-level": "debug"})
+
+    def test_query_usage(self):
+        """A bad option of a query exits with the usage."""
+        for argv in (["app", "--query"], ["app", "--list", "--bogus"]):
+            with self.assertRaises(SystemExit) as exit_error:
+                unicodemoticon.parse_options(argv)
+            self.assertIn("Usage:", str(exit_error.exception.code))
+
+    def test_atlas_memory_usage(self):
+        """A bad atlas memory exits with the usage, not a traceback."""
+        for value in ("64MB", "", "-1"):
+            with self.assertRaises(SystemExit) as exit_error:
+                unicodemoticon.parse_options(
+                    ["app", "--atlas-memory=" + value])
+            self.assertIn("Usage:", str(exit_error.exception.code))
+
+
+class CatalogTest(unittest.TestCase):
+
+    """Compiled catalog files, mapped read-only."""
+
+    def setUp(self):
+        """Give a temporary catalog file."""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.filename = os.path.join(folder, "unicodemoticon.catalog")
+
+    def test_round_trip(self):
+        """The mapped catalog reads as the in-module one."""
+        unicodemoticon.compile_catalog(self.filename)
+        catalog = unicodemoticon.MappedCatalog(self.filename)
+        self.assertEqual(dict(catalog), unicodemoticon.segment_catalog())
+        self.assertEqual(list(catalog), sorted(catalog))
+        self.assertEqual(catalog.htmls, unicodemoticon.HTMLS)
+        self.assertEqual(catalog.digest, unicodemoticon.catalog_digest())
+
+    def test_user_catalog(self):
+        """A given catalog is compiled under its own digest."""
+        user = {"cards": ("\u2660", "\u2663"), "empty": ()}
+        unicodemoticon.compile_catalog(self.filename, user, "", b"u" * 20)
+        catalog = unicodemoticon.MappedCatalog(self.filename, b"u" * 20)
+        self.assertEqual(dict(catalog), user)
+        self.assertEqual(catalog.htmls, "")
+
+    def test_stale(self):
+        """A file of another catalog is stale, the in-module one is used."""
+        unicodemoticon.compile_catalog(self.filename, {"cards": ("x",)},
+                                       "", b"u" * 20)
+        with self.assertRaisesRegex(ValueError, "Stale"):
+            unicodemoticon.MappedCatalog(self.filename)
+        self.assertEqual(unicodemoticon.load_catalog(self.filename), (
+            unicodemoticon.segment_catalog(), unicodemoticon.HTMLS))
+
+    def test_truncated(self):
+        """A truncated file is not read past its end."""
+        unicodemoticon.compile_catalog(self.filename)
+        with open(self.filename, "r+b") as catalog_file:
+            catalog_file.truncate(os.path.getsize(self.filename) - 1)
+        with self.assertRaisesRegex(ValueError, "Truncated"):
+            unicodemoticon.MappedCatalog(self.filename)
+
+    def test_not_catalog(self):
+        """Any other file is not a catalog."""
+        with open(self.filename, "wb") as catalog_file:
+            catalog_file.write(b"x" * unicodemoticon.CATALOG_HEADER.size)
+        with self.assertRaisesRegex(ValueError, "Not a catalog"):
+            unicodemoticon.MappedCatalog(self.filename)
+
+
+class HtmlEntitiesTest(unittest.TestCase):
+
+    """HTML entity index and the chunked clipboard encoder and decoder."""
+
+    TEXT = ("&CounterClockwiseContourIntegral; &amp;&lt;&gt; &#128512;"
+            " &#x1F600; &hearts;&copy &notit; &bogus; & ; caf\u00e9 ") * 50
+
+    def test_decode_chunks(self):
+        """Decoding in chunks is the same as decoding at once."""
+        from html import unescape
+        for chunk_size in (1, 37, 64, 65, 100, 1000, len(self.TEXT)):
+            self.assertEqual("".join(unicodemoticon.html_decode_chunks(
+                self.TEXT, chunk_size)), unescape(self.TEXT), chunk_size)
+
+    def test_encode_chunks(self):
+        """Encoded text decodes back, with canonical entity names."""
+        text = "caf\u00e9 <b>\u2665 & \u00a9</b> \U0001d49c" * 50
+        encoded = "".join(unicodemoticon.html_encode_chunks(text, 64))
+        self.assertTrue(encoded.startswith("caf&eacute; &lt;b&gt;&hearts;"))
+        self.assertNotIn("\u00a9", encoded)
+        self.assertEqual("".join(unicodemoticon.html_decode_chunks(
+            encoded, 64)), text)
+
+    def test_entity_index(self):
+        """The shortest lowercase name with semicolon is canonical."""
+        index = unicodemoticon.html_entity_index()
+        self.assertEqual(index["&"], "amp;")
+        self.assertEqual(index["\u2665"], "hearts;")
+        self.assertTrue(all(name.endswith(";") for name in index.values()))
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    """Ranking of the incremental search."""
+
+    def setUp(self):
+        """Index a small catalog, without emoji annotations."""
+        patcher = mock.patch.object(unicodemoticon, "emoji_annotations",
+                                    lambda: ({}, {}, {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = unicodemoticon.SearchIndex({
+            "cards": ("\U0001F0CF", "\u2665"),
+            "transport": ("\U0001F683",),
+            "cat": ("\u263A",),
+            "cats": ("\U0001F638", "\U0001F639")},
+            {"\u2665": "hearts;"})
+
+    def test_whole_word_first(self):
+        """A whole word ranks over a prefix of a longer word."""
+        self.assertEqual(self.index.search("car"),  # RAILWAY CAR, CARD, cards
+                         ["\U0001F683", "\U0001F0CF", "\u2665"])
+
+    def test_name_over_category(self):
+        """A name ranks over a category, then the catalog order wins."""
+        self.assertEqual(self.index.search("cat"),
+                         ["\U0001F638", "\U0001F639", "\u263A"])
+
+    def test_all_words(self):
+        """Every word of the query must match, as a prefix."""
+        self.assertEqual(self.index.search("cat TEA"), ["\U0001F639"])
+        self.assertEqual(self.index.search("cat zebra"), [])
+        self.assertEqual(self.index.search(""), [])
+
+    def test_entity(self):
+        """HTML entity names are searched too."""
+        self.assertEqual(self.index.search("hearts"), ["\u2665"])
+
+    def test_limit(self):
+        """No more than the limit of results."""
+        self.assertEqual(len(self.index.search("c", 2)), 2)
+
+
+class TransferRateTest(unittest.TestCase):
+
+    """Download throughput estimator."""
+
+    def test_steady(self):
+        """A steady transfer is estimated at its rate."""
+        rate = unicodemoticon.TransferRate()
+        for second in range(10):
+            rate.update(second * 1000, float(second))
+        self.assertAlmostEqual(rate.rate, 1000.0)
+        self.assertAlmostEqual(rate.eta(5000), 5.0)
+
+    def test_smoothing(self):
+        """A burst moves the estimate by the weight of its duration."""
+        rate = unicodemoticon.TransferRate(half_life=2.0)
+        rate.update(0, 0.0)
+        rate.update(1000, 1.0)
+        rate.update(5000, 3.0)  # 2000 bytes per second for a half life
+        self.assertAlmostEqual(rate.rate, 1500.0)
+
+    def test_same_time(self):
+        """Samples at the same time are not divided by zero, nor kept."""
+        rate = unicodemoticon.TransferRate()
+        rate.update(0, 1.0)
+        rate.update(1000, 1.0)
+        self.assertEqual(rate.rate, 0.0)
+        self.assertIsNone(rate.eta(1000))
+        rate.update(1000, 2.0)
+        self.assertAlmostEqual(rate.rate, 1000.0)
+
+
+class RecentPicksTest(unittest.TestCase):
+
+    """Recent section of the tray menu."""
+
+    def setUp(self):
+        """Give a temporary recent file."""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.filename = os.path.join(folder, "config", "recent.json")
+
+    def test_order(self):
+        """The most recent pick is first, a repeated pick moves first."""
+        recent = unicodemoticon.RecentPicks()
+        for text in ("a", "b", "c", "a"):
+            recent.add(text)
+        self.assertEqual(list(recent), ["a", "c", "b"])
+
+    def test_cap(self):
+        """The oldest pick is dropped when full."""
+        recent = unicodemoticon.RecentPicks(size=3)
+        for text in "abcde":
+            recent.add(text)
+        self.assertEqual(list(recent), ["e", "d", "c"])
+
+    def test_save_load(self):
+        """Saved picks load in the same order, cut to the size."""
+        recent = unicodemoticon.RecentPicks()
+        for text in "abcd":
+            recent.add(text)
+        recent.save(self.filename)
+        loaded = unicodemoticon.RecentPicks(size=3)
+        loaded.load(self.filename)
+        self.assertEqual(list(loaded), ["d", "c", "b"])
+
+    def test_load_invalid(self):
+        """Anything but a list of strings is not loaded."""
+        os.makedirs(os.path.dirname(self.filename))
+        for text, picks in (('{"a": 1}', []),
+                            ('["a", 1, null, "b"]', ["a", "b"]),
+                            ("[", [])):
+            with open(self.filename, "w", encoding="utf-8") as recent_file:
+                recent_file.write(text)
+            recent = unicodemoticon.RecentPicks()
+            recent.load(self.filename)
+            self.assertEqual(list(recent), picks)
+
+
+class EmojiIngestTest(unittest.TestCase):
+
+    """Ingestion of emoji-test.txt and CLDR annotations."""
+
+    EMOJI_TEST = """\
+# group: Smileys & Emotion
+1F600 ; fully-qualified # \U0001F600 E1.0 grinning face
+263A FE0F ; fully-qualified # \u263A\uFE0F E0.6 smiling face
+263A ; unqualified # \u263A E0.6 smiling face
+
+# group: People & Body
+1F44B ; fully-qualified # \U0001F44B E0.6 waving hand
+1F44B 1F3FB ; fully-qualified # \U0001F44B\U0001F3FB E1.0 waving hand: light
+270C FE0F ; fully-qualified # \u270C\uFE0F E0.6 victory hand
+270C 1F3FD ; fully-qualified # \u270C\U0001F3FD E1.0 victory hand: medium
+1F469 200D 1F4BB ; fully-qualified # \U0001F469\u200D\U0001F4BB E4.0 woman \
+technologist
+1F91D ; fully-qualified # \U0001F91D E3.0 handshake
+1FAF1 1F3FB 200D 1FAF2 1F3FC ; fully-qualified # \U0001FAF1\U0001F3FB\u200D\
+\U0001FAF2\U0001F3FC E14.0 handshake: light skin tone, medium-light skin tone
+1F48F ; fully-qualified # \U0001F48F E0.6 kiss
+1F469 200D 2764 FE0F 200D 1F48B 200D 1F468 ; fully-qualified # \
+\U0001F469\u200D\u2764\uFE0F\u200D\U0001F48B\u200D\U0001F468 \
+E2.0 kiss: woman, man
+1F469 1F3FF 200D 2764 FE0F 200D 1F48B 200D 1F468 1F3FB ; fully-qualified # \
+\U0001F469\U0001F3FF\u200D\u2764\uFE0F\u200D\U0001F48B\u200D\U0001F468\
+\U0001F3FB E13.1 kiss: woman, man, dark skin tone, light skin tone
+1F9D1 1F3FB 200D 2764 FE0F 200D 1F48B 200D 1F9D1 1F3FC ; fully-qualified # \
+\U0001F9D1\U0001F3FB\u200D\u2764\uFE0F\u200D\U0001F48B\u200D\U0001F9D1\
+\U0001F3FC E13.1 kiss: person, person, light skin tone, medium-light skin tone
+# group: Component
+1F3FB ; fully-qualified # \U0001F3FB E1.0 light skin tone
+"""
+    CLDR = """\
+<ldml><annotations>
+<annotation cp="\U0001F600">face | grin</annotation>
+<annotation cp="\U0001F600" type="tts">grinning face, CLDR</annotation>
+<annotation cp="\u2328" type="tts">keyboard</annotation>
+</annotations></ldml>
+"""
+
+    def setUp(self):
+        """Write the emoji-test.txt and CLDR files."""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.emoji_test = os.path.join(folder, "emoji-test.txt")
+        self.cldr = os.path.join(folder, "en.xml")
+        for filename, text in ((self.emoji_test, self.EMOJI_TEST),
+                               (self.cldr, self.CLDR)):
+            with open(filename, "w", encoding="utf-8") as data_file:
+                data_file.write(text)
+
+    def test_parse(self):
+        """Fully qualified graphemes are whole, components are skipped."""
+        parsed = list(unicodemoticon.parse_emoji_test(
+            self.EMOJI_TEST.splitlines()))
+        self.assertEqual(parsed[:2], [
+            ("smileys & emotion", "\U0001F600", "grinning face"),
+            ("smileys & emotion", "\u263A\uFE0F", "smiling face")])
+        self.assertIn(("people & body", "\U0001F469\u200D\U0001F4BB",
+                       "woman technologist"), parsed)
+        self.assertEqual(len(parsed), 13)
+
+    def test_ingest(self):
+        """Skin tones are variants of their base, not catalog entries."""
+        catalog, names, keywords, variants = unicodemoticon.ingest_emoji(
+            self.emoji_test, (self.cldr,))
+        kiss = "\u200D\u2764\uFE0F\u200D\U0001F48B\u200D"  # between people
+        self.assertEqual(catalog, {
+            "smileys & emotion": ("\U0001F600", "\u263A\uFE0F"),
+            "people & body": (
+                "\U0001F44B", "\u270C\uFE0F", "\U0001F469\u200D\U0001F4BB",
+                "\U0001F91D", "\U0001F48F",
+                "\U0001F469" + kiss + "\U0001F468")})
+        self.assertEqual(variants, {
+            "\U0001F44B": ["\U0001F44B\U0001F3FB"],
+            "\u270C\uFE0F": ["\u270C\U0001F3FD"],
+            "\U0001F91D": ["\U0001FAF1\U0001F3FB\u200D\U0001FAF2\U0001F3FC"],
+            "\U0001F469" + kiss + "\U0001F468": [
+                "\U0001F469\U0001F3FF" + kiss + "\U0001F468\U0001F3FB"],
+            "\U0001F48F": [
+                "\U0001F9D1\U0001F3FB" + kiss + "\U0001F9D1\U0001F3FC"]})
+        self.assertEqual(names["\U0001F600"], "grinning face")
+        self.assertEqual(names["\u2328"], "keyboard")
+        self.assertEqual(keywords, {"\U0001F600": ["face", "grin"]})
+
+
+class StyledTableTest(unittest.TestCase):
+
+    """Styled alphabets of the Style Clipboard menu."""
+
+    def style(self, text, style, chunk_size=unicodemoticon.CHUNK_SIZE):
+        """Return the text in the style."""
+        return "".join(unicodemoticon.styled_chunks(text, style, chunk_size))
+
+    def test_styles(self):
+        """Letters and digits are styled, the rest is left as it is."""
+        self.assertEqual(self.style("Az09 \u00e9!", "Bold"),
+                         "\U0001D400\U0001D433\U0001D7CE\U0001D7D7 \u00e9!")
+        self.assertEqual(self.style("Az09", "Fullwidth"),
+                         "\uFF21\uFF5A\uFF10\uFF19")
+        self.assertEqual(self.style("Az09", "Script"),  # no script digits
+                         "\U0001D49C\U0001D4CF09")
+
+    def test_holes(self):
+        """Letters missing of a mathematical alphabet use the older ones."""
+        self.assertEqual(self.style("BC", "Script"), "\u212C\U0001D49E")
+        self.assertEqual(self.style("C", "Fraktur"), "\u212D")
+        self.assertEqual(self.style("C", "Double-Struck"), "\u2102")
+
+    def test_table(self):
+        """Every style maps every ASCII char, styled or not."""
+        for style in unicodemoticon.STYLED_ALPHABETS:
+            table = unicodemoticon.styled_table(style)
+            self.assertEqual(len(table), 128)
+            self.assertEqual(table[ord(" ")], ord(" "))
+            self.assertNotEqual(table[ord("A")], ord("A"), style)
+
+    def test_chunks(self):
+        """Styling in chunks is the same as at once."""
+        text = "The quick brown fox jumps over the lazy dog 1234567890 " * 9
+        self.assertEqual(self.style(text, "Circled", 7),
+                         self.style(text, "Circled"))
+
+
+class FontCoverageTest(unittest.TestCase):
+
+    """Glyphs the installed fonts can render."""
+
+    def test_updated(self):
+        """Only the chars of the changed labels are checked again."""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        coverage = unicodemoticon.FontCoverage(
+            unicodemoticon.QFont("Oxygen", 25), {"a": ("x", "y")}, "old",
+            os.path.join(folder, "coverage.json"))
+        coverage._missing = {"y", "w"}
+        checked = []
+        with mock.patch.object(unicodemoticon.FontCoverage, "is_missing",
+                               lambda self, char: checked.append(char) or
+                               char == "z"):
+            updated = coverage.updated(
+                {"a": ("x", "y"), "b": ("w", "z")}, "new", {"b"})
+        self.assertEqual(sorted(checked), ["w", "z"])
+        self.assertEqual(updated.missing, {"y", "z"})
+        self.assertTrue(os.path.exists(os.path.join(folder, "coverage.json")))
+
+
+class GlyphAtlasTest(unittest.TestCase):
+
+    """Pre-rendered glyph pixmaps, in memory and on disk."""
+
+    def setUp(self):
+        """Give a temporary atlas folder."""
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def atlas(self, cells=100):
+        """Return an atlas keeping up to cells pixmaps in memory."""
+        atlas = unicodemoticon.GlyphAtlas(unicodemoticon.QFont("Oxygen", 25),
+                                          directory=self.folder)
+        atlas.memory_limit = cells * atlas.cell * atlas.cell * 4
+        return atlas
+
+    def test_memory_limit(self):
+        """The least recently used pixmaps are evicted over the limit."""
+        atlas = self.atlas(cells=3)
+        for glyph in "abca":
+            atlas.pixmap(glyph)
+        atlas.pixmap("d")
+        self.assertEqual(list(atlas._pixmaps), ["c", "a", "d"])
+        self.assertEqual((atlas.hits, atlas.disk_hits, atlas.misses),
+                         (1, 0, 4))
+        atlas.pixmap("b")  # evicted, but not saved to disk yet
+        self.assertEqual((atlas.disk_hits, atlas.misses), (1, 4))
+        self.assertAlmostEqual(atlas.hit_ratio, 2 / 6)
+
+    def test_reload(self):
+        """Saved glyphs are copied from disk, not rendered again."""
+        atlas = self.atlas()
+        images = {glyph: atlas.pixmap(glyph).toImage() for glyph in "ab"}
+        atlas.save()
+        reloaded = self.atlas()
+        for glyph in "ab":
+            self.assertEqual(reloaded.pixmap(glyph).toImage(), images[glyph])
+        self.assertEqual((reloaded.disk_hits, reloaded.misses), (2, 0))
+        self.assertEqual(reloaded.hit_ratio, 1.0)
+
+    def test_failed_save(self):
+        """A failed save keeps the previous atlas, and saves on retry."""
+        atlas = self.atlas()
+        image = atlas.pixmap("a").toImage()
+        atlas.save()
+        atlas.pixmap("b")
+        with mock.patch.object(unicodemoticon, "atomic_write",
+                               side_effect=OSError("disk full")):
+            atlas.save()
+        reloaded = self.atlas()
+        self.assertEqual(reloaded.pixmap("a").toImage(), image)
+        reloaded.pixmap("b")
+        self.assertEqual((reloaded.disk_hits, reloaded.misses), (1, 1))
+        atlas.save()  # the cells not saved were kept in memory
+        reloaded = self.atlas()
+        for glyph in "ab":
+            reloaded.pixmap(glyph)
+        self.assertEqual((reloaded.disk_hits, reloaded.misses), (2, 0))
+
+
+class ChangedLabelsTest(unittest.TestCase):
+
+    """Menus to update when the catalogs are reloaded."""
+
+    BUILT_IN = {"cats": ("a", "b"), "hearts": ("c",)}
+
+    def test_user_catalog_added(self):
+        """A user category replacing a built-in one with others changes."""
+        from collections import ChainMap
+        self.assertEqual(unicodemoticon.changed_labels(
+            ChainMap(self.BUILT_IN), ChainMap(
+                {"cats": ("x",), "hearts": ("c",), "new": ("y",)},
+                self.BUILT_IN)), {"cats", "new"})
+
+    def test_user_catalog_removed(self):
+        """The categories of a removed catalog change back."""
+        from collections import ChainMap
+        self.assertEqual(unicodemoticon.changed_labels(ChainMap(
+            {"cats": ("x",), "new": ("y",)}, self.BUILT_IN),
+            ChainMap(self.BUILT_IN)), {"cats", "new"})
+
+    def test_same_glyphs(self):
+        """A modified catalog with the same glyphs changes nothing."""
+        from collections import ChainMap
+        self.assertEqual(unicodemoticon.changed_labels(
+            ChainMap({"cats": ("a", "b")}, self.BUILT_IN),
+            ChainMap({"cats": ("a", "b"), "hearts": ("c",)},
+                     self.BUILT_IN)), set())
+
+    def test_not_compared_whole(self):
+        """Catalogs without digest are the same if they are the same."""
+        from collections import ChainMap
+
+        class Uncomparable(dict):
+
+            """Catalog that fails if compared as a whole."""
+
+            def __eq__(self, other):
+                """Fail, comparing whole catalogs is slow."""
+                raise AssertionError("compared as a whole")
+
+            __ne__, __hash__ = __eq__, None
+
+        built_in = Uncomparable(self.BUILT_IN)
+        self.assertEqual(unicodemoticon.changed_labels(
+            ChainMap({"cats": ("a", "b")}, built_in),
+            ChainMap({"cats": ("x",)}, built_in)), {"cats"})
+
+    def test_mapped_catalogs(self):
+        """Mapped catalogs are compared only if their digest changed."""
+        from collections import ChainMap
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        catalogs = []
+        for name, digest, catalog in (
+                ("old", b"o" * 20, {"cats": ("x",), "stars": ("s",)}),
+                ("new", b"n" * 20, {"cats": ("x",), "stars": ("t",)}),
+                ("same", b"o" * 20, {"cats": ("x",), "stars": ("s",)})):
+            filename = os.path.join(folder, name + ".catalog")
+            unicodemoticon.compile_catalog(filename, catalog, "", digest)
+            catalogs.append(unicodemoticon.MappedCatalog(filename, digest))
+        old, new, same = catalogs
+        self.assertEqual(unicodemoticon.changed_labels(
+            ChainMap(old, self.BUILT_IN), ChainMap(new, self.BUILT_IN)),
+            {"stars"})
+        self.assertEqual(unicodemoticon.changed_labels(
+            ChainMap(old, self.BUILT_IN), ChainMap(same, self.BUILT_IN)),
+            set())
+
+
+if __name__ in '__main__':
+    unittest.main()
@@ -15,34 +15,36 @@ __source__ = ('https://raw.githubusercontent.com/juancarlospaco/'
 
 
 # imports
+import json
 import logging as log
+import mmap
 import os
 import signal
+import socket
+import struct
 import sys
+import threading
 import time
-from copy import copy
+from collections import ChainMap, OrderedDict
+from collections.abc import Mapping
 from ctypes import byref, cdll, create_string_buffer
-from datetime import datetime
-from getopt import getopt
+from functools import lru_cache
+from getopt import GetoptError, getopt
+from hashlib import sha1, sha256
+from heapq import nlargest
 from os import path
-from subprocess import call
-from tempfile import gettempdir
-from urllib import request
-from webbrowser import open_new_tab
-from html import entities
-
-from PyQt5.QtCore import QUrl
-from PyQt5.QtGui import QCursor, QFont, QIcon
-from PyQt5.QtNetwork import (QNetworkAccessManager, QNetworkProxyFactory,
-                             QNetworkRequest)
-from PyQt5.QtWidgets import (QApplication, QMenu, QMessageBox, QProgressDialog,
-                             QStyle, QSystemTrayIcon)
+
+# rarely used, imported when needed: cProfile, datetime, html, random, re,
+# subprocess, tracemalloc, unicodedata, webbrowser, PyQt5.QtNetwork;
+# keep startup imports small, see benchmark.py
 
 try:
     import resource  # windows dont have resource
 except ImportError:
     resource = None
 
+STARTED = time.perf_counter()  # the imports phase of StartupProfiler, of Qt
+
 
 QSS_STYLE = """
 QWidget { background-color: #302F2F; border-radius: 9px; font-family: Oxygen }
@@ -51,6 +53,62 @@ QMenu { border: 1px solid gray; color: silver; font-weight: light }
 QMenu::item { padding: 1px 1em 1px 1em; margin: 0; border: 0 }
 QMenu::item:selected { color: black }
 QWidget:disabled { color: #404040 }"""
+CATALOG_FILE = path.join(path.dirname(path.abspath(__file__)),
+                         "unicodemoticon.catalog")
+CATALOG_MAGIC, CATALOG_FORMAT = b"UEMC", 1
+USER_CATALOG_PARSER = 2  # in the digest of cached user catalogs, 2 graphemes
+CATALOG_HEADER = struct.Struct("<4sH20sIII")  # magic,format,digest,n,html
+CATALOG_RECORD = struct.Struct("<II")  # offset,length of an utf-8 string
+CHUNK_SIZE, TIME_SLICE = 65536, 0.01  # chars per chunk, seconds per slice
+SEARCH_RESULTS = 12
+LONG_OPTIONS = ("compile-catalog", "new-instance", "list", "query=",
+                "category=", "format=", "atlas-memory=", "profile",
+                "profile-dump=", "log-level=", "update-url=",
+                "no-update-check")
+QUERY_OPTIONS = {"--list", "--query", "--category"}  # no Qt, see query_main
+NEW_INSTANCE_OPTIONS = {"--compile-catalog", "--new-instance", "--profile"}
+UID = os.getuid() if hasattr(os, "getuid") else 0
+SOCKET_FILE = path.join(  # in a folder private to the user, see socket_dir
+    os.environ.get("XDG_RUNTIME_DIR") or "/tmp/unicodemoticon-{}".format(UID),
+    "unicodemoticon-{}.sock".format(UID))
+PROGRESS_INTERVAL = 0.25  # seconds between download dialog repaints
+RECENT_SIZE, RECENT_SAVE_DELAY = 10, 5000  # items, milliseconds
+CONFIG_DIR = path.join(path.expanduser("~"), ".config/unicodemoticon")
+CACHE_DIR = path.join(path.expanduser("~"), ".cache/unicodemoticon")
+RECENT_FILE = path.join(CONFIG_DIR, "recent.json")
+USER_CATALOG_DIR = path.join(CONFIG_DIR, "catalogs")  # *.json and *.toml
+COVERAGE_FILE = path.join(CACHE_DIR, "coverage.json")
+EMOJI_TEST_FILES = (path.join(USER_CATALOG_DIR, "emoji-test.txt"),  # 1st wins
+                    "/usr/share/unicode/emoji/emoji-test.txt",
+                    "/usr/share/unicode-data/emoji-test.txt")
+CLDR_FILES = (path.join(USER_CATALOG_DIR, "en.xml"),  # all existing are used
+              "/usr/share/unicode/cldr/common/annotations/en.xml",
+              "/usr/share/unicode/cldr/common/annotationsDerived/en.xml")
+STYLED_ALPHABETS = OrderedDict((  # style: unicodedata names, 1st existing wins
+    ("Circled", ("CIRCLED LATIN {case} LETTER {letter}",
+                 "CIRCLED DIGIT {digit}")),
+    ("Fullwidth", ("FULLWIDTH LATIN {case} LETTER {letter}",
+                   "FULLWIDTH DIGIT {digit}")),
+    ("Bold", ("MATHEMATICAL BOLD {case} {letter}",
+              "MATHEMATICAL BOLD DIGIT {digit}")),
+    ("Script", ("MATHEMATICAL SCRIPT {case} {letter}",
+                "SCRIPT {case} {letter}")),
+    ("Fraktur", ("MATHEMATICAL FRAKTUR {case} {letter}",
+                 "BLACK-LETTER {case} {letter}")),
+    ("Double-Struck", ("MATHEMATICAL DOUBLE-STRUCK {case} {letter}",
+                       "DOUBLE-STRUCK {case} {letter}",
+                       "MATHEMATICAL DOUBLE-STRUCK DIGIT {digit}")),
+    ("Negative Squared", ("NEGATIVE SQUARED LATIN CAPITAL LETTER {letter}",))))
+DIGIT_NAMES = ("ZERO", "ONE", "TWO", "THREE", "FOUR", "FIVE", "SIX", "SEVEN",
+               "EIGHT", "NINE")
+SKIN_TONES = frozenset(chr(codepoint) for codepoint in range(0x1F3FB, 0x1F400))
+ATLAS_DIR = CACHE_DIR
+ATLAS_MEMORY, ATLAS_SAVE_DELAY = 4 * 1024 * 1024, 5000  # bytes, milliseconds
+RELOAD_DELAY = 1000  # milliseconds, wait for editors to finish writing
+UPDATE_FILE = path.join(CACHE_DIR, "update.json")
+UPDATE_INTERVAL, UPDATE_RETRY = 86400, 600  # seconds, doubled per failure
+UPDATE_DELAY, PROBE_BYTES = 60000, 1024  # milliseconds, head of the source
+PICKER_SIZE = (640, 480)
 AUTOSTART_DESKTOP_FILE = """
 [Desktop Entry]
 Comment=Trayicon with Unicode Emoticons.
@@ -115,7 +173,7 @@ UNICODEMOTICONS = {
     "plants":
         "💐🌸🌷🍀🌹🌻🌺🍁🍃🍂🌿🌾🍄🌵🌴🌲🌳🌰🌱🌼",
 
-    "tech":
+    "tech 2":
         "☎✉✎⌛⏳⏰⌚✂ℹ☢☣☤✇✆",
 
     "geometry":
@@ -185,24 +243,1081 @@ UNICODEMOTICONS = {
 ###############################################################################
 
 
+def atomic_write(filename, data):
+    """Write bytes or text to a file atomically, readers see old or new.
+
+    The folder is made if missing, raise OSError if it can not write.
+    """
+    temp_file = "{}.{}.tmp".format(filename, os.getpid())
+    os.makedirs(path.dirname(filename) or ".", exist_ok=True)
+    try:
+        with open(temp_file, "wb") as output_file:
+            output_file.write(data.encode("utf-8") if isinstance(data, str)
+                              else data)
+        os.replace(temp_file, filename)  # running readers keep old pages
+    except OSError:
+        if path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def catalog_digest():
+    """Return a SHA1 digest of the in-module catalog, to detect stale files."""
+    return sha1(repr((sorted(UNICODEMOTICONS.items()), HTMLS)).encode(
+        "utf-8")).digest()
+
+
+@lru_cache(maxsize=1)
+def segment_catalog():
+    """Return the in-module catalog as a dict of label to sorted entries.
+
+    Built once, the same dict on every reload, see changed_labels.
+    """
+    return {label: tuple(sorted(UNICODEMOTICONS[label]))
+            for label in sorted(UNICODEMOTICONS.keys())}
+
+
+def compile_catalog(filename=CATALOG_FILE, catalog=None, htmls=HTMLS,
+                    digest=None):
+    """Compile the catalog into a compact binary file that can be mmaped.
+
+    Layout: header, one record per category with the label and the index of
+    its first entry, one record per entry, then an utf-8 blob of strings.
+    Default is the in-module catalog, else a dict of label to sorted entries.
+    """
+    catalog = segment_catalog() if catalog is None else catalog
+    blob = bytearray()
+
+    def add_string(string):
+        """Append an string to the blob and return its record."""
+        data = string.encode("utf-8")
+        blob.extend(data)
+        return CATALOG_RECORD.pack(len(blob) - len(data), len(data))
+
+    html_record = add_string(htmls)
+    category_records, entry_records = [], []
+    for label, entries in catalog.items():
+        category_records.append(add_string(label))
+        category_records.append(CATALOG_RECORD.pack(len(entry_records),
+                                                    len(entries)))
+        entry_records.extend(add_string(entry) for entry in entries)
+    records = category_records + entry_records
+    blob_start = (CATALOG_HEADER.size + CATALOG_RECORD.size +
+                  CATALOG_RECORD.size * len(records))
+    header = CATALOG_HEADER.pack(CATALOG_MAGIC, CATALOG_FORMAT,
+                                 digest or catalog_digest(), len(catalog),
+                                 blob_start, len(blob))
+    atomic_write(filename, header + html_record + b"".join(records) + blob)
+    log.info("Compiled catalog of {} categories to {}.".format(
+        len(catalog), filename))
+    return filename
+
+
+class MappedCatalog(Mapping):
+
+    """Read-only view of a compiled catalog file, shared via mmap."""
+
+    def __init__(self, filename=CATALOG_FILE, digest=None):
+        """Map the file and check it was compiled from this catalog."""
+        with open(filename, "rb") as catalog_file:
+            self._map = mmap.mmap(catalog_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        (magic, file_format, self.digest, self._count, self._blob_start,
+         blob_size) = CATALOG_HEADER.unpack_from(self._map, 0)
+        if (magic, file_format) != (CATALOG_MAGIC, CATALOG_FORMAT):
+            raise ValueError("Not a catalog file: {}".format(filename))
+        if self.digest != (digest or catalog_digest()):
+            raise ValueError("Stale catalog file: {}".format(filename))
+        if self._blob_start + blob_size != len(self._map):
+            raise ValueError("Truncated catalog file: {}".format(filename))
+        self._entries_start = (CATALOG_HEADER.size + CATALOG_RECORD.size *
+                               (1 + 2 * self._count))
+        self._labels = {self._string(CATALOG_HEADER.size +
+                                     CATALOG_RECORD.size * (1 + 2 * index)):
+                        index for index in range(self._count)}
+
+    def _string(self, record_offset):
+        """Decode the string pointed by the record at the given offset."""
+        offset, length = CATALOG_RECORD.unpack_from(self._map, record_offset)
+        start = self._blob_start + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    @property
+    def htmls(self):
+        """Return the characters that have an HTML5 entity menu item."""
+        return self._string(CATALOG_HEADER.size)
+
+    def __getitem__(self, label):
+        """Decode and return the sorted entries of one category."""
+        index = self._labels[label]
+        first, count = CATALOG_RECORD.unpack_from(
+            self._map, CATALOG_HEADER.size + CATALOG_RECORD.size *
+            (2 + 2 * index))
+        return tuple(self._string(self._entries_start + CATALOG_RECORD.size *
+                                  entry) for entry in range(first,
+                                                            first + count))
+
+    def __iter__(self):
+        """Iterate the category labels, in the order they were compiled.
+
+        Sorted for the in-module catalog, in file order for user catalogs.
+        """
+        return iter(self._labels)
+
+    def __len__(self):
+        """Return the number of categories."""
+        return self._count
+
+
+def load_catalog(filename=CATALOG_FILE):
+    """Return the compiled catalog, or the in-module one if missing/stale."""
+    try:
+        catalog = MappedCatalog(filename)
+    except (OSError, ValueError, struct.error) as reason:
+        log.debug("Using in-module catalog: {}".format(reason))
+        catalog, htmls = segment_catalog(), HTMLS
+    else:
+        htmls = catalog.htmls
+    return catalog, htmls
+
+
+def graphemes(text):
+    """Yield the user perceived chars of a text, emoji sequences whole.
+
+    An approximation of Unicode extended grapheme clusters: marks,
+    variation selectors, skin tones, tags and keycaps extend a cluster, a
+    zero width joiner joins the next char, regional indicators pair up.
+    """
+    import unicodedata
+    cluster, joined = "", False
+    for char in text:
+        code = ord(char)
+        if cluster and (
+                joined or char == "\u200d" or char in SKIN_TONES or
+                0xFE00 <= code <= 0xFE0F or 0xE0020 <= code <= 0xE007F or
+                unicodedata.category(char) in ("Mn", "Me", "Mc") or
+                (0x1F1E6 <= code <= 0x1F1FF and len(cluster) == 1 and
+                 0x1F1E6 <= ord(cluster) <= 0x1F1FF)):  # a flag
+            cluster += char
+        else:
+            if cluster:
+                yield cluster
+            cluster = char
+        joined = char == "\u200d"
+    if cluster:
+        yield cluster
+
+
+def parse_user_catalog(filename):
+    """Parse a JSON or TOML file of label to a string or list of entries.
+
+    A string is split in graphemes, whitespace between them is ignored.
+    """
+    if filename.endswith(".toml"):
+        try:
+            import tomllib  # Python 3.11+
+        except ImportError:
+            import tomli as tomllib  # optional dependency
+        with open(filename, "rb") as catalog_file:
+            parsed = tomllib.load(catalog_file)
+    else:
+        with open(filename, encoding="utf-8") as catalog_file:
+            parsed = json.load(catalog_file)
+    catalog = {}
+    for label, entries in parsed.items():
+        if isinstance(entries, str):
+            entries = tuple(grapheme for grapheme in graphemes(entries)
+                            if not grapheme.isspace())
+        elif not isinstance(entries, list):  # a table would give its keys
+            raise ValueError("{} must be a string or a list.".format(label))
+        if not all(isinstance(entry, str) for entry in entries):
+            raise ValueError("Entries of {} must be strings.".format(label))
+        catalog[label.lower()] = tuple(sorted(entries))
+    return catalog
+
+
+def load_user_catalogs(directory=None, cache_dir=None):
+    """Return the user catalogs, compiled and cached while not modified."""
+    directory = directory or USER_CATALOG_DIR
+    cache_dir = cache_dir or CACHE_DIR
+    try:
+        filenames = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    catalogs = []
+    for filename in filenames:
+        if not filename.endswith((".json", ".toml")):
+            continue
+        filename = path.join(directory, filename)
+        try:
+            stat = os.stat(filename)
+            digest = sha1("{}\n{}\n{}\n{}".format(
+                filename, stat.st_mtime_ns, stat.st_size,
+                USER_CATALOG_PARSER).encode("utf-8")).digest()
+            cache_file = path.join(cache_dir, "catalog-{}.catalog".format(
+                sha1(filename.encode("utf-8")).hexdigest()))
+            try:
+                catalogs.append(MappedCatalog(cache_file, digest))
+                continue
+            except (OSError, ValueError, struct.error):
+                log.info("Compiling user catalog: {}".format(filename))
+            os.makedirs(cache_dir, exist_ok=True)
+            compile_catalog(cache_file, parse_user_catalog(filename), "",
+                            digest)
+            catalogs.append(MappedCatalog(cache_file, digest))
+        except (OSError, ValueError, TypeError, AttributeError,
+                ImportError) as reason:
+            log.warning("Skipping user catalog {}: {}".format(
+                filename, reason))
+    return catalogs
+
+
+def parse_emoji_test(lines):
+    """Yield group, emoji and name of each fully qualified emoji-test.txt line.
+
+    Each line has the codepoints of a whole grapheme cluster, so ZWJ
+    sequences, modifiers and variation selectors are kept together.
+    """
+    group = None
+    for line in lines:
+        if line.startswith("# group:"):
+            group = line.split(":", 1)[1].strip().lower()
+        elif line.strip() and not line.startswith("#"):
+            codepoints, _, status_comment = line.partition(";")
+            status, _, comment = status_comment.partition("#")
+            if status.strip() != "fully-qualified" or group == "component":
+                continue
+            words = comment.split()[1:]  # drop the emoji itself
+            if words and words[0][:1] == "E" and words[0][1:2].isdigit():
+                words = words[1:]  # drop the emoji version, like E13.0
+            yield (group, "".join(chr(int(codepoint, 16))
+                                  for codepoint in codepoints.split()),
+                   " ".join(words))
+
+
+def parse_cldr_annotations(filename):
+    """Yield emoji, is a name, and text of each CLDR annotation, streaming."""
+    from xml.etree.ElementTree import iterparse
+    for _, element in iterparse(filename):
+        if element.tag == "annotation" and element.text:
+            yield (element.get("cp"), element.get("type") == "tts",
+                   element.text.strip())
+        element.clear()
+
+
+def ingest_emoji(emoji_test_file, cldr_files=()):
+    """Return emoji catalog, names, keywords and skin tone variants.
+
+    Variants are not catalog entries, they are grouped under their base.
+    The base of a sequence with many tones, like a handshake or a couple,
+    is not the sequence without tones, so it is found by name instead,
+    like kiss: woman, man for kiss: woman, man, dark skin tone, else kiss.
+    """
+    catalog, names, keywords, variants = OrderedDict(), {}, {}, {}
+    bases = {}  # name of an emoji without skin tones: emoji
+    with open(emoji_test_file, encoding="utf-8") as emoji_test:
+        for group, emoji, name in parse_emoji_test(emoji_test):
+            names[emoji] = name
+            base = "".join(char for char in emoji if char not in SKIN_TONES)
+            if base == emoji:
+                bases.setdefault(name, emoji)
+            elif base not in names:
+                base = base[0] + "\ufe0f" + base[1:]  # fully qualified base
+            if base != emoji and base not in names:  # eg. handshake: a, b
+                label, _, details = name.partition(": ")
+                details = ", ".join(detail for detail in details.split(", ")
+                                    if not detail.endswith("skin tone"))
+                base = bases.get(label + ": " + details, bases.get(label))
+            if base != emoji and base in names:
+                variants.setdefault(base, []).append(emoji)
+            else:
+                catalog.setdefault(group, []).append(emoji)
+    for cldr_file in cldr_files:
+        for emoji, is_name, text in parse_cldr_annotations(cldr_file):
+            if is_name:
+                names.setdefault(emoji, text)
+            else:
+                keywords[emoji] = [word.strip() for word in text.split("|")]
+    return ({group: tuple(emojis) for group, emojis in catalog.items()},
+            names, keywords, variants)
+
+
+def emoji_sources():
+    """Return the first existing emoji-test.txt and all CLDR files, if any."""
+    emoji_test_files = [filename for filename in EMOJI_TEST_FILES
+                        if path.isfile(filename)]
+    if not emoji_test_files:
+        return None, ()
+    return emoji_test_files[0], tuple(filename for filename in CLDR_FILES
+                                      if path.isfile(filename))
+
+
+def catalog_sources():
+    """Return the existing files and folders the catalogs are loaded from."""
+    sources = [CATALOG_FILE] + list(EMOJI_TEST_FILES) + list(CLDR_FILES)
+    if path.isdir(USER_CATALOG_DIR):
+        sources.append(USER_CATALOG_DIR)
+        sources.extend(path.join(USER_CATALOG_DIR, filename)
+                       for filename in os.listdir(USER_CATALOG_DIR)
+                       if filename.endswith((".json", ".toml")))
+    else:  # to notice when the folder of the user catalogs is created
+        folder = USER_CATALOG_DIR
+        while not path.isdir(folder) and path.dirname(folder) != folder:
+            folder = path.dirname(folder)
+        sources.append(folder)
+    return {source for source in sources if path.exists(source)}
+
+
+@lru_cache(maxsize=1)
+def load_emoji_catalog(cache_dir=None):
+    """Return the ingested emoji catalog, cached while sources dont change.
+
+    Names, keywords and variants are cached aside, see emoji_annotations.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    emoji_test_file, cldr_files = emoji_sources()
+    if not emoji_test_file:
+        return None
+    try:
+        digest = sha1("\n".join("{}\n{}\n{}".format(
+            filename, os.stat(filename).st_mtime_ns, os.stat(filename).st_size)
+            for filename in (emoji_test_file,) + cldr_files).encode(
+                "utf-8")).digest()
+        cache_file = path.join(cache_dir, "emoji.catalog")
+        try:
+            return MappedCatalog(cache_file, digest)
+        except (OSError, ValueError, struct.error):
+            log.info("Ingesting emoji data: {}".format(emoji_test_file))
+        catalog, names, keywords, variants = ingest_emoji(emoji_test_file,
+                                                          cldr_files)
+        atomic_write(path.join(cache_dir, "emoji.json"), json.dumps(
+            {"digest": digest.hex(), "names": names, "keywords": keywords,
+             "variants": variants}, ensure_ascii=False))
+        compile_catalog(cache_file, catalog, "", digest)
+        return MappedCatalog(cache_file, digest)
+    except (OSError, ValueError, SyntaxError) as reason:  # xml ParseError
+        log.warning("Skipping emoji data {}: {}".format(
+            emoji_test_file, reason))
+        return None
+
+
+@lru_cache(maxsize=1)
+def emoji_annotations(cache_dir=None):
+    """Return the names, keywords and variants of the ingested emoji."""
+    cache_dir = cache_dir or CACHE_DIR
+    emoji_catalog = load_emoji_catalog(cache_dir)
+    if emoji_catalog is not None:
+        try:
+            with open(path.join(cache_dir, "emoji.json"),
+                      encoding="utf-8") as annotations_file:
+                annotations = json.load(annotations_file)
+            if annotations["digest"] == emoji_catalog.digest.hex():
+                return (annotations["names"], annotations["keywords"],
+                        annotations["variants"])
+        except (OSError, ValueError, KeyError) as reason:
+            log.warning("No emoji annotations: {}".format(reason))
+    return {}, {}, {}
+
+
+def glyph_name(glyph):
+    """Return the emoji name if ingested, else the Unicode names."""
+    names = emoji_annotations()[0]
+    if glyph in names:
+        return names[glyph]
+    import unicodedata
+    return " + ".join(unicodedata.name(char, "?") for char in glyph)
+
+
+def prepare_catalogs(catalogs=None):
+    """Load, sort and index the catalogs, data only, safe off the GUI thread.
+
+    Return the catalog, its digest, the sorted labels, the sorted HTML
+    entity and char pairs and the search index, of the HTML chars too.
+    """
+    catalog, htmls, digest = catalogs or load_all_catalogs()
+    html_entries = sorted_html_entries(htmls)
+    return (catalog, digest, sorted(catalog.keys()), html_entries,
+            SearchIndex(query_catalog(catalog, html_entries)[0],
+                        html_entity_index()))
+
+
+def changed_labels(old, new):
+    """Return the labels whose glyphs differ between two catalog ChainMaps.
+
+    Catalogs with the same digest, or the same object if they have none,
+    are the same, so only the labels of the added, removed or modified
+    catalogs are compared, never whole catalogs.
+    """
+    labels = set()
+    for catalogs, others in ((old.maps, new.maps), (new.maps, old.maps)):
+        digests = {other.digest for other in others
+                   if hasattr(other, "digest")}
+        for catalog in catalogs:
+            if hasattr(catalog, "digest"):
+                same = catalog.digest in digests
+            else:
+                same = any(catalog is other for other in others)
+            if not same:
+                labels.update(catalog.keys())
+    return {label for label in labels
+            if tuple(old.get(label, ())) != tuple(new.get(label, ()))}
+
+
+def load_all_catalogs():
+    """Return user over emoji over built-in catalogs, HTMLS and a digest.
+
+    User categories replace others with the same label.
+    """
+    catalog, htmls = load_catalog()
+    user_catalogs = load_user_catalogs()
+    emoji_catalog = load_emoji_catalog()
+    if emoji_catalog is not None:
+        user_catalogs.append(emoji_catalog)
+    digest = sha1(catalog_digest() + b"".join(
+        user_catalog.digest for user_catalog in user_catalogs)).hexdigest()
+    return ChainMap(*user_catalogs, catalog), htmls, digest
+
+
+###############################################################################
+
+
+@lru_cache(maxsize=1)
+def html_entity_index():
+    """Return a dict of character to its canonical HTML5 entity name.
+
+    Canonical is the shortest name ending with semicolon, lowercase first.
+    """
+    from html import entities
+    index = {}
+    for name in sorted(entities.html5, key=lambda name: (
+            len(name), not name.islower(), name)):
+        if name.endswith(";"):
+            index.setdefault(entities.html5[name], name)
+    return index
+
+
+def sorted_html_entries(htmls):
+    """Return the sorted HTML entity and char pairs of the HTML chars."""
+    entity_index = html_entity_index()
+    return sorted((entity_index[char], char) for char in set(htmls)
+                  if char in entity_index)
+
+
+@lru_cache(maxsize=1)
+def html_encode_table():
+    """Return a str.translate table of characters to named HTML entities."""
+    return {ord(char): "&" + name for char, name in html_entity_index().items()
+            if len(char) == 1 and (ord(char) > 127 or char in "&<>\"'")}
+
+
+def html_encode_chunks(text, chunk_size=CHUNK_SIZE):
+    """Yield the text encoded to named or else numeric HTML entities."""
+    table = html_encode_table()
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size].translate(table).encode(
+            "ascii", "xmlcharrefreplace").decode("ascii")
+
+
+def html_decode_chunks(text, chunk_size=CHUNK_SIZE):
+    """Yield the text with named and numeric HTML entities decoded."""
+    from html import unescape
+    start = 0
+    while start < len(text):
+        end = start + max(chunk_size, 64)  # longer than any entity
+        ampersand = text.rfind("&", max(start, end - 40), end)
+        if end < len(text) and ampersand > start:
+            end = ampersand  # dont split an entity between chunks
+        yield unescape(text[start:end])
+        start = end
+
+
+@lru_cache(maxsize=None)
+def styled_table(style):
+    """Return a str.translate table of ASCII letters and digits to a style.
+
+    The table is a tuple indexed by ordinal, faster than a dict, chars out
+    of it or without a styled version in Unicode are left as they are.
+    """
+    from string import ascii_letters, digits
+    from unicodedata import lookup
+    table = list(range(128))
+    for char in ascii_letters + digits:
+        names = {"case": "CAPITAL" if char.isupper() else "SMALL",
+                 "letter": char.upper()}
+        if char.isdigit():
+            names = {"digit": DIGIT_NAMES[int(char)]}
+        for template in STYLED_ALPHABETS[style]:
+            try:
+                table[ord(char)] = lookup(template.format(**names))
+                break
+            except KeyError:  # no such char, or a template of other kind
+                continue
+    return tuple(table)
+
+
+def styled_chunks(text, style, chunk_size=CHUNK_SIZE):
+    """Yield the text with letters and digits in a styled alphabet."""
+    table = styled_table(style)
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size].translate(table)
+
+
+class SearchIndex(object):
+
+    """Word prefix index of glyphs by name, keyword, category and entity."""
+
+    NAME, ENTITY, CATEGORY = 3, 2, 1  # field weights for the ranking
+
+    def __init__(self, catalog, entity_index):
+        """Index every glyph of the catalog, once."""
+        keywords = emoji_annotations()[1]
+        self.glyphs, self.prefixes, ids = [], {}, {}
+        for label in catalog:
+            for glyph in catalog[label]:
+                glyph = glyph.strip()
+                if glyph not in ids:
+                    ids[glyph] = len(self.glyphs)
+                    self.glyphs.append(glyph)
+                    self._add_words(ids[glyph], self.NAME,
+                                    glyph_name(glyph))
+                    self._add_words(ids[glyph], self.NAME,
+                                    " ".join(keywords.get(glyph, ())))
+                    if glyph in entity_index:
+                        self._add_words(ids[glyph], self.ENTITY,
+                                        entity_index[glyph].rstrip(";"))
+                self._add_words(ids[glyph], self.CATEGORY, label)
+
+    def _add_words(self, glyph_id, weight, text):
+        """Add every prefix of every word with its best score for a glyph."""
+        for word in text.lower().replace("-", " ").replace(":", " ").split():
+            for length in range(1, len(word) + 1):
+                # a whole word match ranks over a partial prefix match
+                score = 2 * weight + (length == len(word))
+                scores = self.prefixes.setdefault(word[:length], {})
+                if scores.get(glyph_id, 0) < score:
+                    scores[glyph_id] = score
+
+    def search(self, query, limit=SEARCH_RESULTS):
+        """Return the best glyphs matching all words of the query."""
+        words, ranking = query.lower().replace("-", " ").split(), None
+        for word in words:
+            scores = self.prefixes.get(word, {})
+            if ranking is None:
+                ranking = dict(scores)
+            else:
+                ranking = {glyph_id: ranking[glyph_id] + score for glyph_id,
+                           score in scores.items() if glyph_id in ranking}
+            if not ranking:
+                return []
+        return [self.glyphs[glyph_id] for glyph_id in nlargest(
+            limit, ranking or (), key=lambda glyph_id: (ranking[glyph_id],
+                                                        -glyph_id))]
+
+
+class RecentPicks(object):
+
+    """Bounded least recently used list of picked emoticons."""
+
+    def __init__(self, size=RECENT_SIZE):
+        """Init class."""
+        self.size, self._picks = size, OrderedDict()
+
+    def add(self, text):
+        """Move the text to the front, dropping the oldest if full."""
+        self._picks[text] = None
+        self._picks.move_to_end(text, last=False)
+        if len(self._picks) > self.size:
+            self._picks.popitem()
+
+    def __iter__(self):
+        """Iterate the picks, most recent first."""
+        return iter(self._picks)
+
+    def load(self, filename=RECENT_FILE):
+        """Load the picks from a JSON file, if any."""
+        try:
+            with open(filename, encoding="utf-8") as recent_file:
+                picks = json.load(recent_file)
+        except (OSError, ValueError) as reason:
+            log.debug("No recent emoticons loaded: {}".format(reason))
+            return
+        if not isinstance(picks, list):
+            return log.warning("Ignoring {}, not a list.".format(filename))
+        picks = [text for text in picks if isinstance(text, str)]
+        for text in reversed(picks[:self.size]):
+            self.add(text)
+
+    def save(self, filename=RECENT_FILE):
+        """Save the picks to a JSON file atomically, if it can."""
+        try:
+            atomic_write(filename, json.dumps(list(self), ensure_ascii=False))
+        except OSError as reason:  # runs from a timer slot, dont crash
+            log.warning("Can not save recent emoticons: {}".format(reason))
+
+
+def parse_version(text, source=False):
+    """Return the version tuple of a __version__ line, or of a string.
+
+    With source the text must have the __version__ line, not any digits.
+    """
+    import re
+    match = re.search(r"""__version__ = ['"]([^'"]+)['"]""", text)
+    if match:
+        text = match.group(1)
+    elif source or "__version__" in text:
+        return None  # not our source, eg. a login page, or line cut before
+    version = tuple(int(number) for number in re.findall(r"\d+", text))
+    return version or None
+
+
+class UpdateState(object):
+
+    """What the last update probe learned and when to probe again.
+
+    Saved on disk, failures back off exponentially with jitter so many
+    desktops dont probe the origin all at once.
+    """
+
+    def __init__(self, url, filename=UPDATE_FILE):
+        """Init class, for the source at url."""
+        self.url, self.filename = url, filename
+        self.version = self.etag = self.last_modified = None
+        self.next_check, self.failures = 0.0, 0
+
+    def load(self):
+        """Load the state from a JSON file, if it is of the same url."""
+        try:
+            with open(self.filename, encoding="utf-8") as update_file:
+                state = json.load(update_file)
+            if state["url"] == self.url:
+                self.version, self.etag = state["version"], state["etag"]
+                self.last_modified = state["last_modified"]
+                self.next_check = float(state["next_check"])
+                self.failures = int(state["failures"])
+        except (OSError, ValueError, KeyError, TypeError) as reason:
+            log.debug("No update state loaded: {}".format(reason))
+        return self
+
+    def save(self):
+        """Save the state to a JSON file atomically, kept in memory if not."""
+        try:
+            atomic_write(self.filename, json.dumps({
+                "url": self.url, "version": self.version, "etag": self.etag,
+                "last_modified": self.last_modified,
+                "next_check": self.next_check, "failures": self.failures}))
+        except OSError as reason:
+            log.warning("Can not save the update state: {}".format(reason))
+
+    def due(self, now):
+        """Return True if it is time to probe again."""
+        return now >= self.next_check
+
+    def succeeded(self, version, etag, last_modified, now):
+        """Remember a probed version and its validators."""
+        from random import uniform
+        self.version, self.etag = version, etag
+        self.last_modified, self.failures = last_modified, 0
+        self.next_check = now + UPDATE_INTERVAL * uniform(0.9, 1.1)
+        self.save()
+
+    def failed(self, now):
+        """Back off exponentially, up to the normal interval."""
+        from random import uniform
+        self.failures += 1
+        self.next_check = now + min(UPDATE_RETRY * 2 ** (self.failures - 1),
+                                    UPDATE_INTERVAL) * uniform(0.5, 1.0)
+        self.save()
+
+
+class TransferRate(object):
+
+    """Throughput estimator, an exponentially weighted moving average."""
+
+    def __init__(self, half_life=2.0):
+        """Init class, older samples weight half after half_life seconds."""
+        self.rate, self.half_life = 0.0, half_life
+        self._bytes = self._time = None
+
+    def update(self, total_bytes, now):
+        """Add a sample of total bytes transferred at a monotonic time."""
+        if self._time is not None and now > self._time:
+            elapsed = now - self._time
+            sample = (total_bytes - self._bytes) / elapsed
+            if self.rate:
+                self.rate += (1 - 0.5 ** (elapsed / self.half_life)) * (
+                    sample - self.rate)
+            else:
+                self.rate = sample
+        if self._time is None or now > self._time:
+            self._bytes, self._time = total_bytes, now
+        return self.rate
+
+    def eta(self, remaining_bytes):
+        """Return the estimated seconds to transfer the bytes, or None."""
+        return remaining_bytes / self.rate if self.rate > 0 else None
+
+
+def memory_usage():
+    """Return the current and the peak resident memory in KiB, or None."""
+    current = peak = None
+    try:  # linux only, in pages, second field is the resident set
+        with open("/proc/self/statm", "rb") as statm:
+            current = int(statm.read().split()[1]) * (
+                os.sysconf("SC_PAGE_SIZE") // 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource:  # ru_maxrss is in KiB on Linux and BSD, in bytes on Mac
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (
+            1024 if sys.platform.startswith("darwin") else 1)
+        peak = max(peak, current or 0)  # ru_maxrss is sampled lazily
+    return current, peak
+
+
+class StartupProfiler(object):
+
+    """Time, memory and allocations of each startup phase, for --profile."""
+
+    def __init__(self, dump_file=None, top=5, started=STARTED):
+        """Init class, start tracing allocations and maybe cProfile.
+
+        The first phase is timed from started, the import of the module.
+        """
+        import tracemalloc
+        self.tracemalloc, self.dump_file = tracemalloc, dump_file
+        self.top, self.tracing = top, not tracemalloc.is_tracing()
+        if self.tracing:  # else traced since the interpreter, leave it on
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.time, self.elapsed, self.profile = started, 0.0, None
+        if dump_file:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def phase(self, name):
+        """Log the time, memory and top allocations since the last phase."""
+        elapsed = time.perf_counter() - self.time
+        if self.profile:
+            self.profile.disable()  # dont profile the profiler
+        self.elapsed += elapsed
+        snapshot = self.tracemalloc.take_snapshot()
+        allocated, peak_allocated = self.tracemalloc.get_traced_memory()
+        current, peak = memory_usage()
+        log.info("Profile {}: {:.3f}s, traced {} KiB (peak {} KiB), "
+                 "RSS {} KiB (peak {} KiB).".format(
+                     name, elapsed, allocated // 1024, peak_allocated // 1024,
+                     current, peak))
+        stats = [stat for stat in snapshot.compare_to(
+            self.snapshot, "filename")
+            if stat.traceback[0].filename != self.tracemalloc.__file__]
+        for stat in stats[:self.top]:
+            log.info("Profile {}:   {}".format(name, stat))
+        self.snapshot = snapshot
+        if self.profile:
+            self.profile.enable()
+        self.time = time.perf_counter()  # the bookkeeping is not counted
+
+    def stop(self, counts=None):
+        """Log the totals and object counts, dump the cProfile stats."""
+        log.info("Profile total: {:.3f}s{}.".format(self.elapsed, "".join(
+            ", {} {}".format(count, label)
+            for label, count in sorted((counts or {}).items()))))
+        if self.tracing:
+            self.tracemalloc.stop()
+        self.snapshot = None
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.dump_file)
+            log.info("Profile stats dumped to {}, read with: python3 -m "
+                     "pstats {}".format(self.dump_file, self.dump_file))
+
+
+class ColorFormatter(log.Formatter):
+
+    """Log formatter with ANSI colors by level, for terminals."""
+
+    COLORS = ((50, '\x1b[31;5;7m\n '),  # blinking red with black
+              (40, '\x1b[31m'),  # red
+              (30, '\x1b[33m'),  # yellow
+              (20, '\x1b[32m'),  # green
+              (10, '\x1b[35m'))  # pink
+
+    def format(self, record):
+        """Format the record and color it by its level."""
+        message = super(ColorFormatter, self).format(record)
+        for levelno, color in self.COLORS:
+            if record.levelno >= levelno:
+                return color + message + ' \x1b[0m'
+        return message
+
+
+def setup_logging(level="info"):
+    """Log through a queue to one stderr handler on a background thread.
+
+    The GUI thread only enqueues records, formatting and writing to a slow
+    terminal never block the event loop.
+    """
+    import atexit
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import SimpleQueue
+    handler = log.StreamHandler(sys.stderr)
+    handler.setFormatter((
+        ColorFormatter if not sys.platform.startswith("win") and
+        sys.stderr.isatty() else log.Formatter)(
+            "%(levelname)s:%(asctime)s %(message)s"))
+    records = SimpleQueue()
+    root = log.getLogger()
+    root.handlers[:] = [QueueHandler(records)]
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)  # flush the queue at exit
+    try:
+        root.setLevel(level.upper())
+    except ValueError:
+        root.setLevel(log.INFO)
+        log.warning("Unknown log level {}, using info.".format(level))
+    return listener
+
+
+def open_url(url):
+    """Open an URL or a local file with the default application."""
+    if url.startswith(("http:", "https:")):
+        from webbrowser import open_new_tab
+        return open_new_tab(url)
+    from subprocess import call
+    return call(('xdg-open ' if sys.platform.startswith("linux") else
+                 'open ') + url, shell=True)
+
+
+def parse_options(argv=None):
+    """Parse the command line options, leave unknown options to Qt.
+
+    A query exits with the usage on a bad option, else only the known long
+    options are taken and the others, like -style fusion, are skipped.
+    """
+    argv = sys.argv if argv is None else argv
+    if any(arg.split("=")[0] in QUERY_OPTIONS for arg in argv[1:]):
+        try:
+            return dict(getopt(argv[1:], "", LONG_OPTIONS)[0])
+        except GetoptError as error:
+            sys.exit("{}\nUsage: {} --list | [--query=WORDS] "
+                     "[--category=NAME] [--format=tsv|json]".format(
+                         error, path.basename(argv[0])))
+    opts, args = {}, iter(argv[1:])
+    for arg in args:
+        name, equals, value = arg.partition("=")
+        if not name.startswith("--"):
+            continue  # eg. -style, or its value
+        if name[2:] in LONG_OPTIONS and not equals:
+            opts[name] = ""
+        elif name[2:] + "=" in LONG_OPTIONS:
+            opts[name] = value if equals else next(args, "")
+    try:
+        if int(opts.get("--atlas-memory", 0)) < 0:
+            raise ValueError("negative")
+    except ValueError as error:
+        sys.exit("--atlas-memory must be KiloBytes: {}\nUsage: {} "
+                 "[--atlas-memory=KIB] [--log-level=LEVEL] [--profile] "
+                 "[--profile-dump=FILE] [--new-instance]".format(
+                     error, path.basename(argv[0])))
+    return opts
+
+
+def query_catalog(catalog, html_entries):
+    """Return the catalog with the HTML5 chars and the glyph categories."""
+    catalog = dict(catalog, html5=tuple(char for _, char in html_entries))
+    categories = OrderedDict()
+    for label in catalog:
+        for glyph in catalog[label]:
+            categories.setdefault(glyph.strip(), []).append(label)
+    return catalog, categories
+
+
+@lru_cache(maxsize=1)
+def query_prepared():
+    """Return the query catalog and categories, loaded once, not indexed."""
+    catalog, htmls = load_all_catalogs()[:2]
+    return query_catalog(catalog, sorted_html_entries(htmls))
+
+
+@lru_cache(maxsize=1)
+def query_search_index():
+    """Return the search index of the query catalog, built once."""
+    return SearchIndex(query_prepared()[0], html_entity_index())
+
+
+def query_entries(query=None, category=None, prepared=None):
+    """Yield a dict per emoticon matching the query words and category.
+
+    Use the prepared catalog, categories and search index if any, as the
+    running instance has them already, else load them here and build the
+    search index only if there are query words.
+    """
+    variants = emoji_annotations()[2]
+    catalog, categories, search_index = prepared or query_prepared() + (
+        None,)
+    entity_index = html_entity_index()
+    glyphs = categories.keys()
+    if query:
+        glyphs = (search_index or query_search_index()).search(
+            query, len(categories))
+    for glyph in glyphs:
+        if category and category.lower() not in categories[glyph]:
+            continue
+        yield {"glyph": glyph, "category": ",".join(categories[glyph]),
+               "name": glyph_name(glyph),
+               "entity": "&" + entity_index[glyph]
+                         if glyph in entity_index else "",
+               "variants": "".join(variants.get(glyph, ()))}
+
+
+def query_results(request, prepared=None):
+    """Return the entries answering a query request, see query_entries."""
+    if request.get("list"):
+        catalog = prepared[0] if prepared else load_all_catalogs()[0]
+        return ({"category": label, "count": len(catalog[label])}
+                for label in catalog)
+    return query_entries(request.get("query"), request.get("category"),
+                         prepared)
+
+
+def socket_dir(create=False):
+    """Return the folder of the socket, raise OSError if not private.
+
+    Without XDG_RUNTIME_DIR it is in the shared /tmp, where other users
+    could make it first, so it must be ours and closed to the others.
+    """
+    directory = path.dirname(SOCKET_FILE)
+    if create:
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+    import stat
+    status = os.lstat(directory)
+    if (not stat.S_ISDIR(status.st_mode) or status.st_uid != UID or
+            status.st_mode & 0o077):
+        raise PermissionError("Not private to this user: {}".format(
+            directory))
+    return directory
+
+
+def peer_uid(connection):
+    """Return the user id of the peer of a local socket connection.
+
+    Where the system can not tell, the private socket folder is trusted.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return UID
+    credentials = struct.Struct("3i")  # pid, uid, gid
+    return credentials.unpack(connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))[1]
+
+
+def instance_request(requests, timeout=1.0):
+    """Send requests to the running instance and return its responses.
+
+    The protocol is one JSON object per line each way over a local socket,
+    many requests can be batched on one connection. Raise OSError if no
+    instance of this user is running.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Local sockets not supported.")
+    socket_dir()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(SOCKET_FILE)
+        if peer_uid(client) != UID:
+            raise PermissionError("Socket of another user: {}".format(
+                SOCKET_FILE))
+        client.sendall(b"".join(json.dumps(request).encode("utf-8") + b"\n"
+                                for request in requests))
+        with client.makefile("rb") as responses:
+            return [json.loads(responses.readline().decode("utf-8"))
+                    for _ in requests]
+
+
+def query_main(opts):
+    """Command line query mode, streams TSV or JSON lines without Qt."""
+    output_format = opts.get("--format", "tsv").lower()
+    request = {"command": "query", "list": "--list" in opts,
+               "query": opts.get("--query"),
+               "category": opts.get("--category")}
+    try:  # the running instance has everything loaded and indexed already
+        entries = instance_request([request])[0]["results"]
+    except (OSError, ValueError, KeyError) as reason:
+        log.debug("Querying locally: {}".format(reason))
+        entries = query_results(request)
+    try:
+        for entry in entries:
+            if output_format == "json":
+                sys.stdout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            else:
+                sys.stdout.write("\t".join(str(value) for value in
+                                           entry.values()) + "\n")
+        sys.stdout.flush()
+    except BrokenPipeError:  # eg. head, dmenu or rofi closed the pipe
+        sys.stderr.close()
+
+
+if __name__ in '__main__':
+    if QUERY_OPTIONS & set(parse_options()):
+        sys.exit(query_main(parse_options()))  # dont pay for importing Qt
+    if not NEW_INSTANCE_OPTIONS & set(parse_options()):
+        try:
+            instance_request([{"command": "show"}])
+        except (OSError, ValueError):
+            pass  # no running instance, start one
+        else:
+            sys.exit()  # the running instance shows its menu
+
+
+# Qt is imported only after the command line query mode had its chance,
+# importing it takes longer than answering a query, hence noqa: E402.
+from PyQt5.QtCore import (QAbstractListModel, QEventLoop,  # noqa: E402
+                          QFileSystemWatcher, QModelIndex, QObject, QRect,
+                          QSize, QSocketNotifier, QStandardPaths, Qt,
+                          QTimer, QUrl, pyqtSignal)
+from PyQt5.QtGui import (QColor, QCursor, QFont, QFontDatabase,  # noqa: E402
+                         QFontMetrics, QIcon, QIconEngine, QImage, QPainter,
+                         QPixmap, QTextLayout)
+from PyQt5.QtWidgets import (QAction, QApplication,  # noqa: E402
+                             QLineEdit, QListView, QMenu, QMessageBox,
+                             QProgressDialog, QProxyStyle, QStyle,
+                             QSystemTrayIcon, QVBoxLayout, QWidget,
+                             QWidgetAction)
+
+
+###############################################################################
+
+
 class Downloader(QProgressDialog):
 
     """Downloader Dialog with complete informations and progress bar."""
 
-    def __init__(self, parent=None):
-        """Init class."""
+    def __init__(self, parent=None, url=__source__, dst=__file__,
+                 checksum=None):
+        """Init class, download url to dst checking its SHA256.
+
+        Without a checksum the one published at url.sha256 is used, as
+        written by sha256sum, if any.
+        """
         super(Downloader, self).__init__(parent)
         self.setWindowTitle(__doc__)
-        if not os.path.isfile(__file__) or not __source__:
+        if not os.path.isfile(dst) or not url:
             return
-        if not os.access(__file__, os.W_OK):
+        if not (os.access(dst, os.W_OK) and
+                os.access(os.path.dirname(os.path.abspath(dst)), os.W_OK)):
             error_msg = ("Destination file permission denied (not Writable)! "
                          "Try again to Update but as root or administrator.")
             log.critical(error_msg)
-            QMessageBox.warning(self, __doc__.title(), error_msg)
+            self.report(error_msg, error=True)
             return
+        from datetime import datetime
+        from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
         self._time, self._date = time.time(), datetime.now().isoformat()[:-7]
-        self._url, self._dst = __source__, __file__
+        self._url, self._dst, self._checksum = url, dst, checksum
+        self._part_file = dst + ".part"  # kept when interrupted, to resume
         log.debug("Downloading from {} to {}.".format(self._url, self._dst))
         if not self._url.lower().startswith("https:"):
             log.warning("Unsecure Download over plain text without SSL.")
@@ -217,22 +1332,135 @@ class Downloader(QProgressDialog):
         <tr><td><b>Total:</b></td>     <td>{} MegaBytes</td> <tr>
         <tr><td><b>Speed:</b></td>     <td>{}</td>
         <tr><td><b>Percent:</b></td>     <td>{}%</td></table><hr>"""
+        self._rate, self._painted = TransferRate(), 0.0
+        self._hash, self._offset = sha256(), 0
+        self._output = open(self._part_file, "ab+")
+        self._output.seek(0)
+        try:  # ETag or Last-Modified of the partial file, to resume it
+            with open(self._part_file + ".validator", "rb") as validator:
+                resume_validator = validator.read()
+        except OSError:
+            resume_validator = None
+            self._output.truncate()
+        for chunk in iter(lambda: self._output.read(CHUNK_SIZE), b""):
+            self._hash.update(chunk)  # resume, hash what we already got
+            self._offset += len(chunk)
+        download_request = QNetworkRequest(QUrl(self._url))
+        if self._offset:
+            log.info("Resuming download from byte {}.".format(self._offset))
+            download_request.setRawHeader(
+                b"Range", "bytes={}-".format(self._offset).encode("ascii"))
+            download_request.setRawHeader(b"If-Range", resume_validator)
         self.manager = QNetworkAccessManager(self)
-        self.manager.finished.connect(self.save_downloaded_data)
         self.manager.sslErrors.connect(self.download_failed)
-        self.progreso = self.manager.get(QNetworkRequest(QUrl(self._url)))
-        self.progreso.downloadProgress.connect(self.update_download_progress)
+        if self._checksum:
+            self.start_download(download_request)
+        else:
+            checksum_reply = self.manager.get(QNetworkRequest(QUrl(
+                self._url + ".sha256")))
+            checksum_reply.finished.connect(
+                lambda: self.read_checksum(checksum_reply, download_request))
         self.show()
         self.exec_()
 
+    def read_checksum(self, checksum_reply, download_request):
+        """Take the published SHA256 if any, then start the download."""
+        if checksum_reply.error() == checksum_reply.NoError:
+            published = bytes(checksum_reply.readAll()).decode(
+                "ascii", "replace").split()[:1]
+            if published and len(published[0]) == 64 and set(
+                    published[0].lower()) <= set("0123456789abcdef"):
+                self._checksum = published[0]
+        checksum_reply.deleteLater()
+        if not self._checksum:
+            log.warning("No SHA256 published at {}.sha256, the download "
+                        "is only checked to compile.".format(self._url))
+        self.start_download(download_request)
+
+    def start_download(self, download_request):
+        """Start streaming the download to the partial file."""
+        self.progreso = self.manager.get(download_request)
+        self.progreso.finished.connect(
+            lambda: self.save_downloaded_data(self.progreso))
+        self.progreso.metaDataChanged.connect(self.check_resumed)
+        self.progreso.readyRead.connect(self.write_downloaded_chunk)
+        self.progreso.downloadProgress.connect(
+            lambda received, total: self.update_download_progress(
+                self._offset + received,
+                self._offset + total if total >= 0 else -1))  # -1 unknown
+
+    def report(self, message, error=False):
+        """Show a message to the user."""
+        if error:
+            QMessageBox.warning(self, __doc__.title(), message)
+        else:
+            QMessageBox.information(self, __doc__.title(), message)
+
+    def check_resumed(self):
+        """Start over if the server ignored our Range request, save ETag."""
+        from PyQt5.QtNetwork import QNetworkRequest
+        status = self.progreso.attribute(
+            QNetworkRequest.HttpStatusCodeAttribute)
+        if self._offset and status == 200:
+            log.warning("Server does not support resume, starting over.")
+            self._output.seek(0)
+            self._output.truncate()
+            self._hash, self._offset = sha256(), 0
+        resume_validator = (self.progreso.rawHeader(b"ETag") or
+                            self.progreso.rawHeader(b"Last-Modified"))
+        if status in (200, 206) and resume_validator:
+            with open(self._part_file + ".validator", "wb") as validator:
+                validator.write(bytes(resume_validator))
+
+    def remove_partial_file(self):
+        """Remove the partial file and its validator, to start over."""
+        for partial_file in (self._part_file, self._part_file + ".validator"):
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+
+    def write_downloaded_chunk(self):
+        """Stream the available data to the partial file on the disk."""
+        from PyQt5.QtNetwork import QNetworkRequest
+        if self.progreso.attribute(
+                QNetworkRequest.HttpStatusCodeAttribute) in (200, 206):
+            chunk = bytes(self.progreso.readAll())
+            self._output.write(chunk)
+            self._hash.update(chunk)
+
     def save_downloaded_data(self, data):
-        """Save all downloaded data to the disk and quit."""
-        log.debug("Download done. Update Done.")
-        with open(os.path.join(self._dst), "wb") as output_file:
-            output_file.write(data.readAll())
+        """Check the downloaded file, then atomically replace dst and quit."""
+        from PyQt5.QtNetwork import QNetworkRequest
+        self.write_downloaded_chunk()
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        self._output.close()
+        if data.error() != data.NoError:
+            error_msg = "Download interrupted, try again to resume: {}".format(
+                data.errorString())
+            log.error(error_msg)
+            if data.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 416:
+                self.remove_partial_file()  # bad partial file, start over
+            data.close()
+            self.report(error_msg, error=True)
+            return self.close()
         data.close()
-        QMessageBox.information(self, __doc__.title(),
-                                "<b>You got the latest version of this App!")
+        digest = self._hash.hexdigest()
+        try:
+            if self._checksum and digest != self._checksum.lower():
+                raise ValueError("SHA256 mismatch, got {}.".format(digest))
+            with open(self._part_file, "rb") as downloaded_file:
+                compile(downloaded_file.read(), self._dst, "exec")
+        except (SyntaxError, ValueError) as reason:
+            error_msg = "Downloaded file is corrupt: {}".format(reason)
+            log.error(error_msg)
+            self.remove_partial_file()
+            self.report(error_msg, error=True)
+            return self.close()
+        os.chmod(self._part_file, os.stat(self._dst).st_mode)
+        os.replace(self._part_file, self._dst)  # atomic, never half written
+        self.remove_partial_file()
+        log.debug("Download done, SHA256 {}. Update Done.".format(digest))
+        self.report("<b>You got the latest version of this App!")
         del self.manager, data
         return self.close()
 
@@ -256,42 +1484,662 @@ class Downloader(QProgressDialog):
         human_time_string += "%02d Seconds" % seconds
         return human_time_string
 
+    def human_speed_string(self, bytes_per_second):
+        """Format a speed, with precision from KiloBytes to GigaBytes."""
+        speed = bytes_per_second / 1024
+        if speed > 1024 * 1024:  # GigaByte speeds
+            return "{} GigaBytes/Second".format(round(speed / 1024 / 1024, 2))
+        if speed > 1024:  # MegaByte speeds
+            return "{} MegaBytes/Second".format(round(speed / 1024, 2))
+        return "{} KiloBytes/Second".format(int(speed))
+
     def update_download_progress(self, bytesReceived, bytesTotal):
-        """Calculate statistics and update the UI with them."""
+        """Feed the speed estimator, repaint the UI at most at a fixed rate."""
+        from datetime import datetime
+        now = time.monotonic()
+        self._rate.update(bytesReceived, now)
+        if (now - self._painted < PROGRESS_INTERVAL and
+                bytesReceived != bytesTotal):
+            return
+        self._painted = now
         downloaded_MB = round(((bytesReceived / 1024) / 1024), 2)
-        total_data_MB = round(((bytesTotal / 1024) / 1024), 2)
-        downloaded_KB, total_data_KB = bytesReceived / 1024, bytesTotal / 1024
-        # Calculate download speed values, with precision from Kb/s to Gb/s
-        elapsed = time.clock()
-        if elapsed > 0:
-            speed = round((downloaded_KB / elapsed), 2)
-            if speed > 1024000:  # Gigabyte speeds
-                download_speed = "{} GigaByte/Second".format(speed // 1024000)
-            if speed > 1024:  # MegaByte speeds
-                download_speed = "{} MegaBytes/Second".format(speed // 1024)
-            else:  # KiloByte speeds
-                download_speed = "{} KiloBytes/Second".format(int(speed))
-        if speed > 0:
-            missing = abs((total_data_KB - downloaded_KB) // speed)
-        percentage = int(100.0 * bytesReceived // bytesTotal)
+        if bytesTotal > 0:
+            total_data_MB = round(((bytesTotal / 1024) / 1024), 2)
+            percentage = int(100.0 * bytesReceived // bytesTotal)
+            missing = self._rate.eta(bytesTotal - bytesReceived)
+            self.setMaximum(100)
+        else:  # unknown size, no Content-Length, a busy progress bar
+            total_data_MB, percentage, missing = "?", 0, None
+            self.setMaximum(0)
         self.setLabelText(self.template.format(
             self._url.lower()[:99], self._dst.lower()[:99],
             self._date, datetime.now().isoformat()[:-7],
             self.seconds_time_to_human_string(time.time() - self._time),
+            "?" if missing is None else
             self.seconds_time_to_human_string(missing),
-            downloaded_MB, total_data_MB, download_speed, percentage))
+            downloaded_MB, total_data_MB,
+            self.human_speed_string(self._rate.rate), percentage))
         self.setValue(percentage)
 
 
+class UpdateProbe(QObject):
+
+    """Background probe of the version of the source, no full download.
+
+    Reads only the head of the source with a Range request, conditional on
+    the ETag or Last-Modified of the last probe, then emits the version,
+    or an empty string if the probe failed.
+    """
+
+    finished = pyqtSignal(str)
+
+    def __init__(self, url=__source__, filename=UPDATE_FILE, parent=None):
+        """Init class, load the state of the previous probes."""
+        super(UpdateProbe, self).__init__(parent)
+        self.state = UpdateState(url, filename).load()
+        self.manager = self.reply = None
+        self.data = b""
+
+    def start(self):
+        """Request the head of the source without blocking."""
+        from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
+        request = QNetworkRequest(QUrl(self.state.url))
+        request.setAttribute(QNetworkRequest.FollowRedirectsAttribute, True)
+        request.setRawHeader(b"Range", "bytes=0-{}".format(
+            PROBE_BYTES - 1).encode("ascii"))
+        if self.state.version and self.state.etag:
+            request.setRawHeader(b"If-None-Match",
+                                 self.state.etag.encode("latin-1"))
+        elif self.state.version and self.state.last_modified:
+            request.setRawHeader(b"If-Modified-Since",
+                                 self.state.last_modified.encode("latin-1"))
+        log.debug("Probing {} for updates.".format(self.state.url))
+        self.manager = QNetworkAccessManager(self)
+        self.reply = self.manager.get(request)
+        self.reply.readyRead.connect(self.read_head)
+        self.reply.finished.connect(self.probed)
+
+    def read_head(self):
+        """Read up to PROBE_BYTES, stop if the server sends the whole file."""
+        chunk = self.reply.read(PROBE_BYTES - len(self.data))
+        self.data += bytes(chunk or b"")  # None if there is no body
+        if len(self.data) >= PROBE_BYTES:
+            self.reply.abort()  # ignored our Range, enough read anyway
+
+    def probed(self):
+        """Remember the version, or back off on failure, then emit it."""
+        from PyQt5.QtNetwork import QNetworkRequest
+        status = self.reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if self.reply.isOpen() and len(self.data) < PROBE_BYTES:
+            self.read_head()
+        version = parse_version(self.data.decode("utf-8", "replace"),
+                                source=True)
+        now = time.time()
+        if status == 304 and self.state.version:
+            version = self.state.version
+            self.state.succeeded(version, self.state.etag,
+                                 self.state.last_modified, now)
+        elif status in (200, 206) and version:
+            version = ".".join(str(number) for number in version)
+            self.state.succeeded(
+                version, bytes(self.reply.rawHeader(b"ETag")).decode(
+                    "latin-1") or None,
+                bytes(self.reply.rawHeader(b"Last-Modified")).decode(
+                    "latin-1") or None, now)
+        else:
+            log.warning("Update probe failed, status {}: {}".format(
+                status, self.reply.errorString()))
+            self.state.failed(now)
+            version = ""
+        log.debug("Update probe found version {!r}.".format(version))
+        self.reply.deleteLater()
+        self.finished.emit(version)
+
+
+class InstanceServer(QObject):
+
+    """Local socket server of the running instance, see instance_request."""
+
+    def __init__(self, show_menu, query, parent=None):
+        """Listen on the local socket, replacing a stale one.
+
+        The query returns the entries answering a query request, or None
+        if the catalogs are not loaded yet.
+        """
+        super(InstanceServer, self).__init__(parent)
+        self.show_menu, self.query, self.clients = show_menu, query, {}
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            socket_dir(create=True)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(SOCKET_FILE)
+            return log.warning("Another instance listens on {}.".format(
+                SOCKET_FILE))
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # none, or stale of an instance that did not close it
+        except OSError as reason:
+            return log.warning("Can not check {}: {}".format(
+                SOCKET_FILE, reason))
+        try:
+            if path.exists(SOCKET_FILE):
+                os.remove(SOCKET_FILE)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(SOCKET_FILE)
+            os.chmod(SOCKET_FILE, 0o600)
+            self.server.listen(16)
+        except OSError as reason:
+            log.warning("Can not listen on {}: {}".format(SOCKET_FILE, reason))
+            return
+        self.server.setblocking(False)
+        self.notifier = QSocketNotifier(self.server.fileno(),
+                                        QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.accept_client)
+        log.debug("Listening on {}.".format(SOCKET_FILE))
+
+    def accept_client(self):
+        """Accept a client and read its requests as they arrive."""
+        try:
+            client = self.server.accept()[0]
+            if peer_uid(client) != UID:
+                client.close()
+                return log.warning("Refused a client of another user.")
+        except OSError:  # BlockingIOError if another notifier took it
+            return
+        client.setblocking(False)  # answers are written when it can take them
+        reader = QSocketNotifier(client.fileno(), QSocketNotifier.Read, self)
+        reader.activated.connect(lambda _: self.read_client(client))
+        writer = QSocketNotifier(client.fileno(), QSocketNotifier.Write, self)
+        writer.setEnabled(False)
+        writer.activated.connect(lambda _: self.write_client(client))
+        self.clients[client] = [reader, writer, b"", b""]  # read, to write
+
+    def read_client(self, client):
+        """Answer every complete request line the client sent so far.
+
+        The answers are written by write_client, and reading waits until
+        the client took them all, so a slow reader never blocks the GUI.
+        """
+        reader, writer, received, _ = self.clients[client]
+        try:
+            data = client.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            return self.drop_client(client)
+        if not data:
+            return self.drop_client(client)
+        *lines, self.clients[client][2] = (received + data).split(b"\n")
+        if lines:
+            self.clients[client][3] += b"".join(
+                json.dumps(self.answer(line)).encode("utf-8") + b"\n"
+                for line in lines)
+            reader.setEnabled(False)
+            writer.setEnabled(True)
+
+    def write_client(self, client):
+        """Write as much of the answers as the client takes now."""
+        reader, writer, _, answers = self.clients[client]
+        try:
+            sent = client.send(answers)
+        except BlockingIOError:
+            return
+        except OSError:
+            return self.drop_client(client)
+        self.clients[client][3] = answers[sent:]
+        if not answers[sent:]:
+            writer.setEnabled(False)
+            reader.setEnabled(True)
+
+    def drop_client(self, client):
+        """Stop watching a client and close its connection."""
+        for notifier in self.clients.pop(client)[:2]:
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        client.close()
+
+    def answer(self, line):
+        """Return the response to one request line."""
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if request.get("command") == "show":
+                self.show_menu()
+                return {"ok": True}
+            if request.get("command") == "query":
+                results = self.query(request)
+                if results is None:
+                    return {"error": "Catalogs not loaded yet."}
+                return {"results": list(results)}
+            return {"error": "Unknown command."}
+        except (ValueError, AttributeError) as reason:
+            return {"error": str(reason)}
+
+    def close(self):
+        """Stop listening and remove the socket file."""
+        if hasattr(self, "notifier"):
+            self.server.close()
+            os.remove(SOCKET_FILE)
+
+
+def font_files():
+    """Yield the path, mtime and size of the files in the font folders."""
+    directories = QStandardPaths.standardLocations(
+        QStandardPaths.FontsLocation) + [
+            path.join(directory, "fonts") for directory in
+            QStandardPaths.standardLocations(
+                QStandardPaths.GenericDataLocation)]
+    for directory in sorted(set(directories)):
+        for root, folders, filenames in os.walk(directory):
+            folders.sort()
+            for filename in sorted(filenames):
+                try:
+                    stat = os.stat(path.join(root, filename))
+                except OSError:
+                    continue  # eg. a broken link
+                yield "{}\t{}\t{}".format(path.join(root, filename),
+                                          stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4)
+def fonts_fingerprint(font_key):
+    """Return a digest of the installed fonts, their files and the font.
+
+    Qt loads the fonts once per process, so they are fingerprinted once.
+    """
+    return sha1("\n".join(QFontDatabase().families() + list(font_files()) +
+                          [font_key]).encode("utf-8")).hexdigest()
+
+
+class FontCoverage(object):
+
+    """Characters the font and its fallbacks can not render, cached on disk.
+
+    The cache is keyed by a fingerprint of the installed font families and
+    files, the font and the catalog, so it is rebuilt only when any of them
+    changes.
+    """
+
+    def __init__(self, font, catalog, digest, filename=COVERAGE_FILE):
+        """Init class, the coverage pass runs on first use only."""
+        self.font, self.catalog, self.filename = font, catalog, filename
+        self.digest, self._missing, self._fingerprint = digest, None, None
+
+    def fingerprint(self):
+        """Return a digest of the installed fonts, the font and catalog."""
+        if self._fingerprint is None:
+            self._fingerprint = sha1((fonts_fingerprint(self.font.key()) +
+                                      self.digest).encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def is_missing(self, char):
+        """Return True if the char renders as tofu, even with fallbacks."""
+        layout = QTextLayout(char, self.font)
+        layout.beginLayout()
+        layout.createLine()
+        layout.endLayout()
+        return not all(glyph for run in layout.glyphRuns()
+                       for glyph in run.glyphIndexes())
+
+    @property
+    def missing(self):
+        """Return the set of missing chars, from the cache if up to date."""
+        if self._missing is not None:
+            return self._missing
+        fingerprint = self.fingerprint()
+        try:
+            with open(self.filename, encoding="utf-8") as coverage_file:
+                cache = json.load(coverage_file)
+            if cache["fingerprint"] == fingerprint:
+                self._missing = set(cache["missing"])
+                return self._missing
+        except (OSError, ValueError, KeyError, TypeError) as reason:
+            log.debug("No font coverage cache: {}".format(reason))
+        started = time.time()
+        self._missing = {char for char in self.chars()
+                         if self.is_missing(char)}
+        log.info("Font coverage: {} chars missing, took {} seconds.".format(
+            len(self._missing), round(time.time() - started, 3)))
+        self.save()
+        return self._missing
+
+    def chars(self, labels=None):
+        """Return the chars of the catalog, or of some of its labels.
+
+        Invisible and combining chars are left out, they have no glyph.
+        """
+        import unicodedata
+        labels = self.catalog if labels is None else [
+            label for label in labels if label in self.catalog]
+        return {char for char in set("".join(
+            "".join(self.catalog[label]) for label in labels))
+            if unicodedata.category(char) not in ("Cf", "Mn", "Me", "Zs")}
+
+    def save(self):
+        """Save the missing chars to the cache file atomically, if it can."""
+        try:
+            atomic_write(self.filename, json.dumps({
+                "fingerprint": self.fingerprint(),
+                "missing": "".join(self._missing)},
+                ensure_ascii=False))
+        except OSError as reason:  # keep using the coverage in memory
+            log.warning("Can not save the font coverage: {}".format(reason))
+
+    def updated(self, catalog, digest, changed):
+        """Return the coverage of a changed catalog, see changed_labels.
+
+        Only the chars of the changed labels are checked again, chars of
+        removed labels may stay missing, they are in no menu anyway.
+        """
+        coverage = FontCoverage(self.font, catalog, digest, self.filename)
+        if self._missing is not None:  # else it is computed on first use
+            chars = coverage.chars(changed)
+            coverage._missing = self._missing  # not copied, self is replaced
+            coverage._missing -= chars
+            coverage._missing.update(char for char in chars
+                                     if coverage.is_missing(char))
+            coverage.save()
+        return coverage
+
+    def covered(self, text):
+        """Return True if every char of the text can be rendered."""
+        return self.missing.isdisjoint(text)
+
+
+class GlyphAtlas(QObject):
+
+    """Glyphs rendered once to pixmaps, so menus dont shape text each paint.
+
+    Pixmaps are kept in memory up to a limit, least recently used evicted.
+    Every rendered glyph is also appended as a raw ARGB32 cell to an atlas
+    file on disk, named by the fonts fingerprint, that is mmaped on the
+    next runs so evicted or new session glyphs are copied not re-rendered.
+    """
+
+    def __init__(self, font, memory_limit=ATLAS_MEMORY, directory=ATLAS_DIR,
+                 parent=None):
+        """Init class, the fonts are fingerprinted on first disk use."""
+        super(GlyphAtlas, self).__init__(parent)
+        self.font, self.memory_limit = font, memory_limit
+        self.cell = QFontMetrics(font).height()
+        self._fingerprint, self._directory = None, directory
+        self._pixmaps, self._memory = OrderedDict(), 0
+        self._index = self._map = None
+        self._rendered = OrderedDict()  # not saved to disk yet
+        self.hits = self.disk_hits = self.misses = 0
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(ATLAS_SAVE_DELAY)
+        self.save_timer.timeout.connect(self.save)
+
+    def _file(self, extension):
+        """Return the path of the atlas file for the current fonts.
+
+        Rasterized glyphs depend on the fonts only, not on the catalogs, so
+        the file stays the same when the catalogs are reloaded.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = fonts_fingerprint(self.font.key())
+        return path.join(self._directory, "atlas-{}-{}.{}".format(
+            self._fingerprint, self.cell, extension))
+
+    def _load_index(self):
+        """Map the atlas file of the current fonts, if any."""
+        self._index, self._map = {}, None
+        try:
+            with open(self._file("json"), encoding="utf-8") as index_file:
+                glyphs = json.load(index_file)
+            with open(self._file("bin"), "rb") as atlas_file:
+                self._map = mmap.mmap(atlas_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as reason:
+            log.debug("No glyph atlas loaded: {}".format(reason))
+            return
+        cells = len(self._map) // (self.cell * self.cell * 4)
+        self._index = {glyph: cell for cell, glyph in
+                       enumerate(glyphs[:cells])}
+
+    def render(self, glyph):
+        """Shape and rasterize the glyph centered in a new cell image."""
+        image = QImage(self.cell, self.cell,
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.setFont(self.font)
+        painter.setPen(QColor("silver"))
+        painter.drawText(QRect(0, 0, self.cell, self.cell), Qt.AlignCenter,
+                         glyph)
+        painter.end()
+        return image
+
+    def pixmap(self, glyph):
+        """Return the pixmap of the glyph, from memory, disk or rendering."""
+        if glyph in self._pixmaps:
+            self.hits += 1
+            self._pixmaps.move_to_end(glyph)
+            return self._pixmaps[glyph]
+        if self._index is None:
+            self._load_index()
+        size = self.cell * self.cell * 4
+        if glyph in self._index:
+            self.disk_hits += 1
+            offset = self._index[glyph] * size
+            image = QImage(self._map[offset:offset + size], self.cell,
+                           self.cell, QImage.Format_ARGB32_Premultiplied
+                           ).copy()  # dont keep a view of the buffer
+        elif glyph in self._rendered:
+            self.disk_hits += 1
+            image = QImage(self._rendered[glyph], self.cell, self.cell,
+                           QImage.Format_ARGB32_Premultiplied).copy()
+        else:
+            self.misses += 1
+            image = self.render(glyph)
+            self._rendered[glyph] = image.constBits().asstring(size)
+            self.save_timer.start()
+        self._pixmaps[glyph] = QPixmap.fromImage(image)
+        self._memory += size
+        while self._memory > self.memory_limit and len(self._pixmaps) > 1:
+            self._pixmaps.popitem(last=False)
+            self._memory -= size
+        return self._pixmaps[glyph]
+
+    @property
+    def hit_ratio(self):
+        """Return the ratio of lookups served without rendering."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def save(self):
+        """Append the newly rendered cells to the atlas file on disk."""
+        if not self._rendered:
+            return
+        if self._index is None:  # a previous save failed
+            self._load_index()
+        glyphs = sorted(self._index, key=self._index.get)
+        if self._map is not None:
+            self._map.close()
+        self._index = self._map = None  # mapped again on the next lookup
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            for old_file in os.listdir(self._directory):  # for other fonts
+                if (old_file.startswith("atlas-") and not
+                        old_file.startswith(path.basename(self._file("")))):
+                    os.remove(path.join(self._directory, old_file))
+            with open(self._file("bin"), "ab") as atlas_file:
+                atlas_file.truncate(len(glyphs) * self.cell * self.cell * 4)
+                for glyph, cell in self._rendered.items():
+                    atlas_file.write(cell)
+                    glyphs.append(glyph)
+            atomic_write(self._file("json"), json.dumps(
+                glyphs, ensure_ascii=False))
+        except OSError as reason:  # keep the new cells in memory
+            return log.warning("Can not save the glyph atlas: {}".format(
+                reason))
+        self._rendered.clear()
+        self._load_index()
+        log.info("Glyph atlas: {}% hit ratio, {} glyphs on disk, {} in "
+                 "memory using {} KiloBytes.".format(
+                     int(self.hit_ratio * 100), len(self._index),
+                     len(self._pixmaps), self._memory // 1024))
+
+
+class AtlasIconEngine(QIconEngine):
+
+    """Icon that paints a glyph from the GlyphAtlas."""
+
+    __slots__ = ("atlas", "glyph")  # one per glyph action, no __dict__ made
+
+    def __init__(self, atlas, glyph):
+        """Init class."""
+        super(AtlasIconEngine, self).__init__()
+        self.atlas, self.glyph = atlas, glyph
+
+    def paint(self, painter, rect, mode, state):
+        """Paint the cached pixmap of the glyph, no text shaping here."""
+        painter.drawPixmap(rect, self.atlas.pixmap(self.glyph))
+
+    def pixmap(self, size, mode, state):
+        """Return the cached pixmap of the glyph."""
+        return self.atlas.pixmap(self.glyph)
+
+    def clone(self):
+        """Return a copy of this icon engine."""
+        return AtlasIconEngine(self.atlas, self.glyph)
+
+
+class AtlasMenuStyle(QProxyStyle):
+
+    """Menu style with icons as big as the glyphs of the atlas."""
+
+    def __init__(self, atlas):
+        """Init class."""
+        super(AtlasMenuStyle, self).__init__()
+        self.atlas = atlas
+
+    def pixelMetric(self, metric, option=None, widget=None):
+        """Return the atlas cell size as the menu icon size."""
+        if metric == QStyle.PM_SmallIconSize:
+            return self.atlas.cell
+        return super(AtlasMenuStyle, self).pixelMetric(metric, option, widget)
+
+
+class GlyphModel(QAbstractListModel):
+
+    """Flat list model of glyphs, views only ask for the visible ones."""
+
+    def __init__(self, atlas, parent=None):
+        """Init class."""
+        super(GlyphModel, self).__init__(parent)
+        self.atlas, self.glyphs = atlas, []
+
+    def set_glyphs(self, glyphs):
+        """Replace all the glyphs of the model."""
+        self.beginResetModel()
+        self.glyphs = list(glyphs)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        """Return the number of glyphs."""
+        return 0 if parent.isValid() else len(self.glyphs)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Return the atlas pixmap, the text or the Unicode name of a glyph."""
+        glyph = self.glyphs[index.row()]
+        if role == Qt.DecorationRole and len(glyph) == 1:
+            return self.atlas.pixmap(glyph)
+        if role == Qt.DisplayRole and len(glyph) > 1:
+            return glyph
+        if role == Qt.ToolTipRole:
+            return glyph_name(glyph)
+        if role == Qt.UserRole:
+            return glyph
+        return None
+
+
+class GlyphPicker(QWidget):
+
+    """Popup grid of every glyph with a filter, for very big catalogs.
+
+    The view uses uniform item sizes and the model creates nothing per
+    glyph, so only the cells on screen are ever painted or measured.
+    """
+
+    def __init__(self, atlas, search, pick, parent=None):
+        """Init class, search returns glyphs for a query, pick copies one."""
+        super(GlyphPicker, self).__init__(parent, Qt.Popup)
+        self.search, self.pick = search, pick
+        self.setStyleSheet(QSS_STYLE.strip())
+        self.resize(*PICKER_SIZE)
+        self.filter_box = QLineEdit(self)
+        self.filter_box.setPlaceholderText("Search...")
+        self.filter_box.setClearButtonEnabled(True)
+        self.filter_box.textChanged.connect(self.update_filter)
+        self.model = GlyphModel(atlas, self)
+        self.view = QListView(self)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setIconSize(QSize(atlas.cell, atlas.cell))
+        self.view.setGridSize(QSize(atlas.cell + 8, atlas.cell + 8))
+        self.view.setFont(atlas.font)
+        self.view.setModel(self.model)
+        self.view.activated.connect(self.pick_index)
+        self.view.clicked.connect(self.pick_index)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.filter_box)
+        layout.addWidget(self.view)
+
+    def update_filter(self, query):
+        """Show only the glyphs matching the query, or all if empty."""
+        self.model.set_glyphs(self.search(query.strip()))
+
+    def pick_index(self, index):
+        """Pick the glyph of the index and close."""
+        self.pick(index.data(Qt.UserRole))
+        self.hide()
+
+    def popup(self, position):
+        """Show the picker at the position, with the filter focused."""
+        if not self.model.glyphs and not self.filter_box.text():
+            self.update_filter("")
+        self.move(position)
+        self.show()
+        self.filter_box.setFocus()
+
+
 ###############################################################################
 
 
+def time_sliced(items, step, done=None):
+    """Call step for each item in time slices, yielding to the event loop."""
+    items = iter(items)
+
+    def run_slice():
+        """Run steps for a time slice, then continue on a timer."""
+        deadline = time.time() + TIME_SLICE
+        for item in items:
+            step(item)
+            if time.time() > deadline:
+                return QTimer.singleShot(0, run_slice)
+        if done:
+            done()
+
+    run_slice()
+
+
 class MainWindow(QSystemTrayIcon):
 
     """Main widget for UnicodEmoticons,not really a window since not needed."""
 
-    def __init__(self, icon, parent=None):
-        """Tray icon main widget."""
+    catalogs_prepared, menus_ready = pyqtSignal(object), pyqtSignal()
+
+    def __init__(self, icon, parent=None, atlas_memory=ATLAS_MEMORY,
+                 catalogs=None, update_url=__source__, update_check=True):
+        """Tray icon main widget, catalogs as returned by load_all_catalogs.
+
+        With update_check, probe update_url for a newer version once due.
+        """
         super(MainWindow, self).__init__(icon, parent)
         log.info("Iniciando {}.".format(__doc__))
         self.setIcon(icon)
@@ -301,94 +2149,406 @@ class MainWindow(QSystemTrayIcon):
         self.traymenu.setIcon(icon)
         self.traymenu.setStyleSheet(QSS_STYLE.strip())
         self.traymenu.addSeparator()
+        # QMenu emits triggered of its submenus too, one slot for every glyph
+        self.traymenu.triggered.connect(self.copy_action_data)
         self.activated.connect(self.click_trap)
-        # menus
-        list_of_labels = sorted(UNICODEMOTICONS.keys())
-        menu0 = self.traymenu.addMenu(list_of_labels[0].title())
-        menu1 = self.traymenu.addMenu(list_of_labels[1].title())
-        menu2 = self.traymenu.addMenu(list_of_labels[2].title())
-        menu3 = self.traymenu.addMenu(list_of_labels[3].title())
-        menu4 = self.traymenu.addMenu(list_of_labels[4].title())
-        menu5 = self.traymenu.addMenu(list_of_labels[5].title())
-        menu6 = self.traymenu.addMenu(list_of_labels[6].title())
-        menu7 = self.traymenu.addMenu(list_of_labels[7].title())
-        menu8 = self.traymenu.addMenu(list_of_labels[8].title())
-        menu9 = self.traymenu.addMenu(list_of_labels[9].title())
-        menu10 = self.traymenu.addMenu(list_of_labels[10].title())
-        menu11 = self.traymenu.addMenu(list_of_labels[11].title())
-        menu12 = self.traymenu.addMenu(list_of_labels[12].title())
-        menu13 = self.traymenu.addMenu(list_of_labels[13].title())
-        menu14 = self.traymenu.addMenu(list_of_labels[14].title())
-        menu15 = self.traymenu.addMenu(list_of_labels[15].title())
-        menu16 = self.traymenu.addMenu(list_of_labels[16].title())
-        menu17 = self.traymenu.addMenu(list_of_labels[17].title())
-        menu18 = self.traymenu.addMenu(list_of_labels[18].title())
-        menu19 = self.traymenu.addMenu(list_of_labels[19].title())
-        menu20 = self.traymenu.addMenu(list_of_labels[20].title())
-        menu21 = self.traymenu.addMenu(list_of_labels[21].title())
-        menu22 = self.traymenu.addMenu(list_of_labels[22].title())
-        menu23 = self.traymenu.addMenu(list_of_labels[23].title())
-        menu24 = self.traymenu.addMenu(list_of_labels[24].title())
-        menu25 = self.traymenu.addMenu(list_of_labels[25].title())
-        menu26 = self.traymenu.addMenu(list_of_labels[26].title())
-        menu27 = self.traymenu.addMenu(list_of_labels[27].title())
-        menu28 = self.traymenu.addMenu(list_of_labels[28].title())
-        menu29 = self.traymenu.addMenu(list_of_labels[29].title())
-        menu30 = self.traymenu.addMenu(list_of_labels[30].title())
-        menu31 = self.traymenu.addMenu(list_of_labels[31].title())
-        menu32 = self.traymenu.addMenu(list_of_labels[32].title())
+        # search
+        self.search_index, self.search_box = None, QLineEdit()
+        self.search_box.setPlaceholderText("Search...")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.textChanged.connect(self.update_search_results)
+        self.search_box.returnPressed.connect(self.pick_first_search_result)
+        search_action = QWidgetAction(self.traymenu)
+        search_action.setDefaultWidget(self.search_box)
+        self.traymenu.addAction(search_action)
+        self.search_results = []
+        for _ in range(SEARCH_RESULTS):
+            action = self.traymenu.addAction("")
+            action.setVisible(False)
+            self.search_results.append(action)
+        self.traymenu.addSeparator()
+        # recent
+        self.recent, self.recent_changed = RecentPicks(), True
+        self.recent.load()
+        self.recent_save_timer = QTimer(self)
+        self.recent_save_timer.setSingleShot(True)
+        self.recent_save_timer.setInterval(RECENT_SAVE_DELAY)
+        self.recent_save_timer.timeout.connect(self.recent.save)
+        self.recent_actions = []
+        for _ in range(RECENT_SIZE):
+            action = self.traymenu.addAction("")
+            action.setVisible(False)
+            self.recent_actions.append(action)
+        self.traymenu.aboutToShow.connect(self.update_recent_actions)
         self.traymenu.addSeparator()
-        menuhtml0 = self.traymenu.addMenu("HTML5 Code")
-        for index, item in enumerate((
-            menu0, menu1, menu2, menu3, menu4, menu5, menu6, menu7, menu8,
-            menu9, menu10, menu11, menu12, menu13, menu14, menu15, menu16,
-            menu17, menu18, menu19, menu20, menu21, menu22, menu23, menu24,
-            menu25, menu26, menu27, menu28, menu29, menu30, menu31, menu32,
-                )):
-            item.setStyleSheet(("font-size:25px;padding:0;margin:0;border:0;"
-                                "font-family:Oxygen;menu-scrollable:1;"))
-            item.setFont(QFont('Oxygen', 25))
-            self.build_submenu(UNICODEMOTICONS[list_of_labels[index]], item)
+        # menus, populated once the catalogs are prepared in background
+        self.catalog = self.coverage = self.digest = self.html_entries = None
+        self.query_prepared = None  # see query
+        self.category_menus, self.built_menus = {}, set()
+        self.atlas = GlyphAtlas(QFont('Oxygen', 25), atlas_memory,
+                                parent=self)
+        self.atlas_style = AtlasMenuStyle(self.atlas)
+        self.menus_anchor = self.traymenu.addSeparator()
+        self.loading_action = QAction("Loading...", self.traymenu)
+        self.loading_action.setDisabled(True)
+        self.traymenu.insertAction(self.menus_anchor, self.loading_action)
+        self.html_menu = self.traymenu.addMenu("HTML5 Code")
         # html entities
-        added_html_entities = []
-        menuhtml0.setStyleSheet("font-size:25px;padding:0;margin:0;border:0;")
-        for html_char in tuple(sorted(entities.html5.items())):
-            if html_char[1] in HTMLS:
-                added_html_entities.append(
-                    html_char[0].lower().replace(";", ""))
-                if not html_char[0].lower() in added_html_entities:
-                    action = menuhtml0.addAction(html_char[1])
-                    action.triggered.connect(
-                        lambda _, ch=html_char[0]:
-                            QApplication.clipboard().setText(
-                                "&{html_entity}".format(html_entity=ch)))
+        self.html_menu.setStyleSheet(
+            "font-size:25px;padding:0;margin:0;border:0;")
+        self.html_menu.setDisabled(True)
+        self.search_box.setDisabled(True)
+        self.picker = None
+        self.picker_action = self.traymenu.addAction("Picker...",
+                                                     self.show_picker)
+        self.picker_action.setDisabled(True)
+        self.traymenu.addAction("HTML Encode Clipboard", lambda:
+                                self.convert_clipboard(html_encode_chunks))
+        self.traymenu.addAction("HTML Decode Clipboard", lambda:
+                                self.convert_clipboard(html_decode_chunks))
+        styled_menu = self.traymenu.addMenu("Style Clipboard")
+        for style in STYLED_ALPHABETS:
+            styled_menu.addAction(style, lambda style=style: (
+                self.convert_clipboard(lambda text: styled_chunks(text,
+                                                                  style))))
         self.traymenu.addSeparator()
         # help
         helpMenu = self.traymenu.addMenu("Help...")
         helpMenu.addAction("About Python 3",
-                           lambda: open_new_tab('https://www.python.org'))
-        helpMenu.addAction("About " + __doc__, lambda: open_new_tab(__url__))
+                           lambda: open_url('https://www.python.org'))
+        helpMenu.addAction("About " + __doc__, lambda: open_url(__url__))
         helpMenu.addSeparator()
         if not sys.platform.startswith("win"):
-            helpMenu.addAction("View Source Code", lambda: call(
-                ('xdg-open ' if sys.platform.startswith("linux") else 'open ')
-                + __file__, shell=True))
+            helpMenu.addAction("View Source Code", lambda: open_url(__file__))
         helpMenu.addSeparator()
         helpMenu.addAction("Report Bugs", lambda:
-                           open_new_tab(__url__ + '/issues?state=open'))
-        helpMenu.addAction("Check for updates", lambda: Downloader())
+                           open_url(__url__ + '/issues?state=open'))
+        helpMenu.addAction("Check for updates", self.check_for_updates)
         self.traymenu.addSeparator()
         self.traymenu.addAction("Quit", lambda: self.close())
         self.setContextMenu(self.traymenu)
+        self.instance_server = InstanceServer(
+            lambda: self.traymenu.popup(QCursor.pos()), self.query, self)
         self.show()
+        self.catalogs_prepared.connect(self.populate_menus)
+        threading.Thread(target=self.prepare_catalogs, args=(catalogs,),
+                         name="prepare_catalogs", daemon=True).start()
+        # hot reload
+        self.reloading, self.reload_timer = False, QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(RELOAD_DELAY)
+        self.reload_timer.timeout.connect(self.reload_catalogs)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.catalog_source_changed)
+        self.watcher.directoryChanged.connect(self.catalog_source_changed)
+        self.watch_catalog_sources()
+        # updates
+        self.update_url, self.update_probe = update_url, None
+        self.messageClicked.connect(self.download_update)
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.timeout.connect(
+            lambda: self.check_for_updates(manual=False))
+        if update_check:
+            self.update_timer.start(UPDATE_DELAY)
         self.add_autostart()
 
+    def prepare_catalogs(self, catalogs, old=None):
+        """Prepare the catalogs on a worker thread, then signal the GUI.
+
+        On a reload, the labels changed from the old catalog are appended.
+        """
+        try:
+            prepared = prepare_catalogs(catalogs)
+            if old is not None:
+                prepared += (changed_labels(old, prepared[0]),)
+        except Exception as reason:  # logged by populate_menus
+            prepared = reason
+        self.catalogs_prepared.emit(prepared)
+
+    def populate_menus(self, prepared):
+        """Add the category menus in time slices, on the GUI thread."""
+        if self.catalog is not None:
+            return self.update_menus(prepared)
+        if isinstance(prepared, Exception):
+            self.loading_action.setText("Can not load the catalogs")
+            return log.critical("Can not load the catalogs: {}".format(
+                prepared))
+        (self.catalog, self.digest, labels, self.html_entries,
+         self.search_index) = prepared
+        self.coverage = FontCoverage(QFont('Oxygen', 25), self.catalog,
+                                     self.digest)
+        self.html_menu.aboutToShow.connect(self.build_html_submenu_once)
+        time_sliced(labels, self.add_category_menu, self.menus_populated)
+
+    def watch_catalog_sources(self):
+        """Watch the catalog sources, return True if any is new."""
+        sources, watched = catalog_sources(), set(
+            self.watcher.files() + self.watcher.directories())
+        if watched - sources:
+            self.watcher.removePaths(list(watched - sources))
+        if sources - watched:  # new, or replaced by an editor
+            self.watcher.addPaths(list(sources - watched))
+        return bool(sources - watched)
+
+    def catalog_source_changed(self, changed_path):
+        """Reload the catalogs soon, editors write files in many steps."""
+        if (self.watch_catalog_sources() or  # else a parent of the catalogs
+                not USER_CATALOG_DIR.startswith(changed_path.rstrip(os.sep) +
+                                                os.sep)):
+            log.debug("Catalog source changed: {}".format(changed_path))
+            self.reload_timer.start()
+
+    def reload_catalogs(self):
+        """Load the catalogs again on a worker thread, see update_menus."""
+        if self.reloading or self.catalog is None:
+            return self.reload_timer.start()  # busy, try again later
+        self.reloading = True
+        for cached in (load_emoji_catalog, emoji_annotations):
+            cached.cache_clear()
+        threading.Thread(target=self.prepare_catalogs,
+                         args=(None, self.catalog), name="reload_catalogs",
+                         daemon=True).start()
+
+    def update_menus(self, prepared):
+        """Apply reloaded catalogs to the live menus, only what changed."""
+        self.reloading = False
+        if isinstance(prepared, Exception):
+            return log.error("Can not reload the catalogs: {}".format(
+                prepared))
+        (catalog, digest, labels, html_entries, search_index,
+         changed) = prepared
+        if digest == self.digest:
+            return log.debug("Catalogs reloaded, nothing changed.")
+        started = time.time()
+        self.coverage = self.coverage.updated(catalog, digest, changed)
+        self.catalog, self.digest = catalog, digest
+        self.search_index, self.query_prepared = search_index, None
+        for label in sorted(changed):
+            menu = self.category_menus.get(label)
+            if label not in catalog:
+                self.traymenu.removeAction(menu.menuAction())
+                self.built_menus.discard(menu)
+                del self.category_menus[label]
+                menu.deleteLater()
+            elif menu is None:
+                self.add_category_menu(label)
+            elif menu in self.built_menus:
+                self.update_submenu(catalog[label], menu)
+        if html_entries != self.html_entries:
+            self.html_entries = html_entries
+            if self.html_menu.actions():  # built already, build it again
+                self.html_menu.clear()
+                self.html_menu.aboutToShow.connect(
+                    self.build_html_submenu_once)
+        if self.picker is not None:  # else it shows the old glyphs
+            self.picker.update_filter(self.picker.filter_box.text())
+        log.info("Catalogs reloaded, {} categories changed, took {} "
+                 "seconds.".format(len(changed),
+                                   round(time.time() - started, 3)))
+
+    def add_category_menu(self, label):
+        """Add the lazily built submenu of a category, sorted by label."""
+        following = [other for other in self.category_menus if other > label]
+        menu = QMenu(label.title().replace("&", "&&"), self.traymenu)
+        menu.setStyleSheet(("font-size:25px;padding:0;margin:0;border:0;"
+                            "font-family:Oxygen;menu-scrollable:1;"))
+        menu.setFont(QFont('Oxygen', 25))
+        menu.setStyle(self.atlas_style)
+        menu.aboutToShow.connect(
+            lambda label=label, menu=menu:
+                self.build_submenu_once(self.catalog[label], menu))
+        self.traymenu.insertMenu(
+            self.category_menus[min(following)].menuAction() if following
+            else self.menus_anchor, menu)
+        self.category_menus[label] = menu
+
+    def menus_populated(self):
+        """Enable what needs the catalogs, the startup is complete."""
+        self.traymenu.removeAction(self.loading_action)
+        for widget in (self.html_menu, self.search_box, self.picker_action):
+            widget.setEnabled(True)
+        log.debug("Menus populated.")
+        self.menus_ready.emit()
+
+    def glyph_action(self, char, submenu):
+        """Return a new action of a char, its data is copied when triggered."""
+        if len(char.strip()) == 1:  # fits in a cell of the atlas
+            action = QAction(QIcon(AtlasIconEngine(self.atlas, char.strip())),
+                             "", submenu)
+        else:
+            action = QAction(char.strip().replace("&", "&&"), submenu)
+        action.setData(char)
+        return action
+
     def build_submenu(self, char_list, submenu):
-        """Take a list of characters and a submenu and build actions on it."""
-        for _char in sorted(char_list):
-            action = submenu.addAction(_char.strip())
-            action.triggered.connect(
-                lambda _, char=_char: QApplication.clipboard().setText(char))
+        """Take a sorted list of characters and a submenu, build actions."""
+        for _char in char_list:
+            if self.coverage.covered(_char):  # else renders as an empty box
+                submenu.addAction(self.glyph_action(_char, submenu))
+
+    def update_submenu(self, char_list, submenu):
+        """Remove and insert actions so a built submenu shows char_list.
+
+        Kept actions are not moved, only the changed chars cost anything.
+        """
+        actions = {action.data(): action for action in submenu.actions()}
+        chars = [char for char in char_list if self.coverage.covered(char)]
+        for char in actions.keys() - set(chars):
+            submenu.removeAction(actions[char])
+            actions.pop(char).deleteLater()
+        following = None  # insert backwards, each before the next char
+        for char in reversed(chars):
+            if char not in actions:
+                actions[char] = self.glyph_action(char, submenu)
+                submenu.insertAction(following, actions[char])
+            following = actions[char]
+
+    def build_html_submenu_once(self):
+        """Build the HTML entities submenu on its first show."""
+        self.html_menu.aboutToShow.disconnect()
+        for html_entity, html_char in self.html_entries:
+            if self.coverage.covered(html_char):  # else an empty box
+                self.html_menu.addAction(html_char).setData(
+                    "&" + html_entity)
+
+    def copy_action_data(self, action):
+        """Copy the text in the data of a triggered glyph action, if any."""
+        text = action.data()
+        if isinstance(text, str):
+            self.copy_to_clipboard(text)
+
+    def copy_to_clipboard(self, text):
+        """Copy the picked text and remember it, saving later in batch."""
+        QApplication.clipboard().setText(text)
+        self.recent.add(text)
+        self.recent_changed = True
+        self.recent_save_timer.start()
+
+    def update_recent_actions(self):
+        """Show the recent picks, only if they changed since last shown."""
+        if not self.recent_changed:
+            return
+        self.recent_changed, picks = False, list(self.recent)
+        for index, action in enumerate(self.recent_actions):
+            if index < len(picks):
+                action.setText(picks[index].strip().replace("&", "&&"))
+                action.setData(picks[index])
+            action.setVisible(index < len(picks))
+
+    def build_submenu_once(self, char_list, submenu):
+        """Build a submenu on its first show and keep it for later opens."""
+        submenu.aboutToShow.disconnect()
+        self.build_submenu(char_list, submenu)
+        self.built_menus.add(submenu)
+
+    def get_search_index(self):
+        """Return the search index, built on first use."""
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.catalog, html_entity_index())
+        return self.search_index
+
+    def query(self, request):
+        """Answer a query request of the instance server, see query_results.
+
+        Reuses the loaded catalog and search index, the categories of the
+        glyphs are built on the first query after each load.
+        """
+        if self.catalog is None:
+            return None
+        if self.query_prepared is None:
+            self.query_prepared = query_catalog(
+                self.catalog, self.html_entries) + (self.search_index,)
+        return query_results(request, self.query_prepared)
+
+    def update_search_results(self, query):
+        """Show the glyphs best matching the query, reusing the actions."""
+        glyphs = [glyph for glyph in self.get_search_index().search(
+            query, SEARCH_RESULTS + len(self.coverage.missing))
+            if self.coverage.covered(glyph)] if query.strip() else ()
+        for index, action in enumerate(self.search_results):
+            if index < len(glyphs):
+                action.setText(glyphs[index].replace("&", "&&"))
+                action.setData(glyphs[index])
+            action.setVisible(index < len(glyphs))
+
+    def pick_first_search_result(self):
+        """Copy the first search result and close the menu."""
+        if self.search_results[0].isVisible():
+            self.search_results[0].trigger()
+            self.traymenu.hide()
+
+    def picker_glyphs(self, query):
+        """Return the renderable glyphs matching the query, or all."""
+        search_index = self.get_search_index()
+        glyphs = (search_index.search(query, len(search_index.glyphs))
+                  if query else search_index.glyphs)
+        return [glyph for glyph in glyphs if self.coverage.covered(glyph)]
+
+    def show_picker(self):
+        """Show the glyph picker at the mouse cursor, created on first use."""
+        if self.picker is None:
+            self.picker = GlyphPicker(self.atlas, self.picker_glyphs,
+                                      self.copy_to_clipboard)
+        self.picker.popup(QCursor.pos())
+
+    def convert_clipboard(self, converter):
+        """Convert the clipboard text by chunks without blocking the tray."""
+        converted = []
+
+        def converted_all():
+            """Put the converted text on the clipboard."""
+            QApplication.clipboard().setText("".join(converted))
+            log.debug("Converted {} chars on clipboard.".format(
+                sum(len(chunk) for chunk in converted)))
+
+        time_sliced(converter(QApplication.clipboard().text()),
+                    converted.append, converted_all)
+
+    def check_for_updates(self, manual=True):
+        """Probe for a newer version in background, when due or if manual."""
+        if self.update_probe is not None:
+            return  # already probing
+        self.update_probe = UpdateProbe(self.update_url, parent=self)
+        if not manual and not self.update_probe.state.due(time.time()):
+            log.debug("Update probe not due yet.")
+            self.schedule_update_check(self.update_probe.state.next_check)
+            self.update_probe.deleteLater()
+            self.update_probe = None
+            return
+        self.update_probe.finished.connect(
+            lambda version: self.update_probed(version, manual))
+        self.update_probe.start()
+
+    def update_probed(self, version, manual):
+        """Offer to download a newer version, else tell if asked for."""
+        if self.update_timer.isActive() or not manual:  # checks are enabled
+            self.schedule_update_check(self.update_probe.state.next_check)
+        self.update_probe.deleteLater()
+        self.update_probe = None
+        if version and parse_version(version) > parse_version(__version__):
+            message = "Version {} is available, you have {}.".format(
+                version, __version__)
+            log.info(message)
+            if not manual:  # dont interrupt, the user clicks to download
+                return self.showMessage(__doc__, message + " Click to update.")
+            if QMessageBox.question(None, __doc__.title(), message +
+                                    " Download it?") == QMessageBox.Yes:
+                self.download_update()
+        elif manual:
+            QMessageBox.information(None, __doc__.title(), (
+                "You got the latest version of this App!" if version else
+                "Can not check for updates, try again later."))
+
+    def schedule_update_check(self, next_check):
+        """Probe again in background at next_check, in epoch seconds."""
+        delay = int((next_check - time.time()) * 1000)
+        self.update_timer.start(min(max(delay, 0), 2 ** 31 - 1))
+        log.debug("Next update probe in {} seconds.".format(delay // 1000))
+
+    def download_update(self):
+        """Download the new version, with a progress dialog."""
+        Downloader(url=self.update_url)
 
     def click_trap(self, value):
         """Trap the mouse tight click."""
@@ -407,6 +2567,10 @@ class MainWindow(QSystemTrayIcon):
 
     def close(self):
         """Overload close method."""
+        if self.recent_save_timer.isActive():
+            self.recent.save()
+        self.atlas.save()
+        self.instance_server.close()
         return sys.exit(0)
 
 
@@ -416,40 +2580,8 @@ class MainWindow(QSystemTrayIcon):
 def main():
     """Main Loop."""
     APPNAME = str(__package__ or __doc__)[:99].lower().strip().replace(" ", "")
-    if not sys.platform.startswith("win") and sys.stderr.isatty():
-        def add_color_emit_ansi(fn):
-            """Add methods we need to the class."""
-            def new(*args):
-                """Method overload."""
-                if len(args) == 2:
-                    new_args = (args[0], copy(args[1]))
-                else:
-                    new_args = (args[0], copy(args[1]), args[2:])
-                if hasattr(args[0], 'baseFilename'):
-                    return fn(*args)
-                levelno = new_args[1].levelno
-                if levelno >= 50:
-                    color = '\x1b[31;5;7m\n '  # blinking red with black
-                elif levelno >= 40:
-                    color = '\x1b[31m'  # red
-                elif levelno >= 30:
-                    color = '\x1b[33m'  # yellow
-                elif levelno >= 20:
-                    color = '\x1b[32m'  # green
-                elif levelno >= 10:
-                    color = '\x1b[35m'  # pink
-                else:
-                    color = '\x1b[0m'  # normal
-                try:
-                    new_args[1].msg = color + str(new_args[1].msg) + ' \x1b[0m'
-                except Exception as reason:
-                    print(reason)  # Do not use log here.
-                return fn(*new_args)
-            return new
-        # all non-Windows platforms support ANSI Colors so we use them
-        log.StreamHandler.emit = add_color_emit_ansi(log.StreamHandler.emit)
-    log.basicConfig(level=-1, format="%(levelname)s:%(asctime)s %(message)s")
-    log.getLogger().addHandler(log.StreamHandler(sys.stderr))
+    opts = parse_options()
+    setup_logging(opts.get("--log-level", "info"))
     log.info(__doc__)
     try:
         os.nice(19)  # smooth cpu priority
@@ -459,6 +2591,12 @@ def main():
         libc.prctl(15, byref(buff), 0, 0, 0)
     except Exception as reason:
         log.warning(reason)
+    if "--compile-catalog" in opts:
+        return compile_catalog()
+    profiler = None
+    if "--profile" in opts or "--profile-dump" in opts:
+        profiler = StartupProfiler(opts.get("--profile-dump"))
+        profiler.phase("imports")
     signal.signal(signal.SIGINT, signal.SIG_DFL)  # CTRL+C work to quit app
     app = QApplication(sys.argv)
     app.setApplicationName(APPNAME)
@@ -466,11 +2604,28 @@ def main():
     app.setOrganizationDomain(APPNAME)
     icon = QIcon(app.style().standardPixmap(QStyle.SP_FileIcon))
     app.setWindowIcon(icon)
-    win = MainWindow(icon)
-    win.show()
-    log.info('Total Maximum RAM Memory used: ~{} MegaBytes.'.format(int(
-        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
-        resource.getpagesize() / 1024 / 1024 if resource else 0)))
+    catalogs = None  # loaded on a worker thread after the tray icon shows
+    if profiler:
+        catalogs = load_all_catalogs()
+        profiler.phase("catalog")
+        html_entity_index()  # cached, the worker thread reuses it
+        profiler.phase("entities")
+    win = MainWindow(icon, atlas_memory=int(opts.get(
+        "--atlas-memory", ATLAS_MEMORY // 1024)) * 1024, catalogs=catalogs,
+        update_url=opts.get("--update-url", __source__),
+        update_check="--no-update-check" not in opts)
+    if profiler:
+        profiler.phase("tray icon")
+        loop = QEventLoop()
+        win.menus_ready.connect(loop.quit)
+        loop.exec_()  # entity and search indexes on the worker, then menus
+        profiler.phase("prepare")
+        for menu in win.traymenu.findChildren(QMenu):
+            menu.aboutToShow.emit()  # builds the lazy submenus now
+        profiler.phase("menus")
+        profiler.stop({"QActions": len(win.traymenu.findChildren(QAction)),
+                       "QMenus": len(win.traymenu.findChildren(QMenu)) + 1})
+    log.info("RAM used: {} KiB, maximum {} KiB.".format(*memory_usage()))
     sys.exit(app.exec_())
 
 